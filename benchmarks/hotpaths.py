@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks of client-side hot paths.
+
+Times and memory-profiles response parsing and post-processing in isolation on fixture payloads of several sizes:
+similarity graph transform (XML and JSON), annotation stamping, concept matrix parameters and XML parsing.
+Fixtures are generated from a fixed seed; --record DIR writes them to files and --fixtures DIR reads payloads
+from files of the same names instead, e.g. responses recorded from the service.
+  python benchmarks/hotpaths.py [--repeat N] [--sizes small,medium] [--only NAME] [--save FILE]
+  python benchmarks/hotpaths.py --baseline FILE [--max-regression 0.25]
+Exits with non-zero status if median time of any case grows more than --max-regression over the baseline."""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from ispras import texterra
+from ispras.ispras import decode
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Number of concepts in graphs and concept lists, annotations in documents
+SIZES = {'small': 10, 'medium': 100, 'large': 400}
+WORDS = u'текст text анализ analysis семантика concept знание knowledge'.split()
+TAGS = ['NN', 'VB', 'JJ', 'IN', 'DT']
+
+def graphPayload(n, format, rnd):
+  """Similarity graph of n concepts: positions and upper triangle rows"""
+  ids = rnd.sample(range(1, 10 * n + 1), n)
+  rows = [[round(rnd.random(), 6) for _ in range(n - i - 1)] for i in range(n - 1)]
+  if format == 'json':
+    return ids, json.dumps({'concept-2-position': [{'concept': {'id': c, 'kb-name': 'enwiki'}, 'integer': i} for i, c in enumerate(ids)],
+                            'similarity': rows}).encode('utf-8')
+  entries = ''.join('<entry><concept><id>{0}</id><kb-name>enwiki</kb-name></concept><integer>{1}</integer></entry>'.format(c, i) for i, c in enumerate(ids))
+  doubles = ''.join('<double>{0}</double>'.format(', '.join(repr(v) for v in row)) for row in rows)
+  return ids, ('<full-similarity-graph><concept-2-position>{0}</concept-2-position><similarity>{1}</similarity></full-similarity-graph>'.format(entries, doubles)).encode('utf-8')
+
+def documentPayload(n, rnd):
+  """Texterra document with n pos-token annotations"""
+  words, annotations, pos = [], [], 0
+  for _ in range(n):
+    word = rnd.choice(WORDS)
+    annotations.append({'start': pos, 'end': pos + len(word), 'value': {'type': rnd.choice(TAGS)}})
+    words.append(word)
+    pos += len(word) + 1
+  text = u' '.join(words)
+  return text, json.dumps({'text': text, 'annotations': {'pos-token': annotations}}, ensure_ascii=False).encode('utf-8')
+
+def attributesPayload(n, rnd):
+  """getAttributes XML response for n concepts"""
+  items = ''.join('<concept-attributes><concept><id>{0}</id><kb-name>enwiki</kb-name></concept>'
+                  '<attributes><title>{1}</title><type>{2}</type></attributes></concept-attributes>'.format(rnd.randint(1, 10 ** 7), rnd.choice(WORDS), rnd.choice(TAGS))
+                  for _ in range(n))
+  return u'<list>{0}</list>'.format(items).encode('utf-8')
+
+class Fixtures(object):
+  """Payloads by name, generated or read from directory"""
+
+  def __init__(self, directory=None, record=None):
+    self.directory = directory
+    self.record = record
+
+  def payload(self, name, generated):
+    path = os.path.join(self.directory, name) if self.directory else None
+    if path and os.path.exists(path):
+      with open(path, 'rb') as f:
+        return f.read()
+    if self.record:
+      with open(os.path.join(self.record, name), 'wb') as f:
+        f.write(generated)
+    return generated
+
+def cases(size, fixtures):
+  """Yields (name, size, setup, function): function(*setup()) is measured"""
+  n = SIZES[size]
+  rnd = random.Random(n)
+  wrapConcepts = texterra.API(host='http://localhost/')._API__wrapConcepts
+
+  for format in ('json', 'xml'):
+    ids, content = graphPayload(n, format, rnd)
+    content = fixtures.payload('graph-{0}.{1}'.format(size, format), content)
+    parsed = decode(content, format)
+    yield ('transformGraph.' + format, size, lambda ids=ids, parsed=parsed: (ids, parsed), texterra.transformGraph)
+    yield ('decode.graph.' + format, size, lambda content=content, format=format: (content, format), decode)
+
+  text, content = documentPayload(n * 10, rnd)
+  content = fixtures.payload('document-{0}.json'.format(size), content)
+  yield ('stampAnnotations', size, lambda: (text, decode(content, 'json')), texterra.stampAnnotations)
+  yield ('decode.document.json', size, lambda: (content, 'json'), decode)
+
+  concepts = list(range(n * 10))
+  yield ('wrapConcepts', size, lambda: (concepts, 'enwiki'), wrapConcepts)
+
+  content = fixtures.payload('attributes-{0}.xml'.format(size), attributesPayload(n, rnd))
+  yield ('decode.attributes.xml', size, lambda: (content, 'xml'), decode)
+
+def measure(setup, function, repeat):
+  """Returns median time (us) and peak allocated memory (KiB) of function(*setup())"""
+  times = []
+  gc.disable()
+  try:
+    for _ in range(repeat):
+      args = setup()
+      start = timer()
+      function(*args)
+      times.append((timer() - start) * 1e6)
+  finally:
+    gc.enable()
+  times.sort()
+  peak = None
+  if tracemalloc is not None:
+    args = setup()
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 1024.0
+    tracemalloc.stop()
+  return times[len(times) // 2], peak
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=20)
+  parser.add_argument('--sizes', default=','.join(sorted(SIZES, key=SIZES.get)))
+  parser.add_argument('--only', default=None, help='run cases whose name starts with this prefix')
+  parser.add_argument('--fixtures', default=None, help='directory with recorded payloads')
+  parser.add_argument('--record', default=None, help='directory to write generated payloads to')
+  parser.add_argument('--save', default=None, help='file to write report to')
+  parser.add_argument('--baseline', default=None, help='report to compare with')
+  parser.add_argument('--max-regression', type=float, default=0.25)
+  args = parser.parse_args()
+
+  fixtures = Fixtures(args.fixtures, args.record)
+  baseline = {}
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+
+  report, failed = {}, False
+  for size in args.sizes.split(','):
+    for name, size, setup, function in cases(size, fixtures):
+      if args.only and not name.startswith(args.only):
+        continue
+      key = '{0}[{1}]'.format(name, size)
+      median, peak = measure(setup, function, args.repeat)
+      report[key] = {'median_us': median, 'peak_kib': peak}
+      line = '{0:32} median {1:12.1f} us'.format(key, median)
+      if peak is not None:
+        line += '  peak {0:10.1f} KiB'.format(peak)
+      if key in baseline:
+        change = median / baseline[key]['median_us'] - 1
+        line += '  {0:+7.1%}'.format(change)
+        if change > args.max_regression:
+          line += '  regression'
+          failed = True
+      print(line)
+
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  return 1 if failed else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
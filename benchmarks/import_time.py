@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Cold import benchmark for ispras modules.
+
+Every run starts a fresh interpreter, so the numbers are what a short-lived worker pays.
+  python benchmarks/import_time.py [--runs N] [--max-ms MS] [module ...]
+Exits with non-zero status if a heavy dependency is loaded at import time
+or the median import time exceeds --max-ms."""
+import os
+import sys
+import subprocess
+import argparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Modules that must only be loaded on first request
+LAZY_MODULES = ['requests', 'xmltodict']
+
+PROBE = """
+import sys, time
+start = time.time()
+import {0}
+elapsed = (time.time() - start) * 1000
+print('%f %s' % (elapsed, ','.join(m for m in {1!r} if m in sys.modules)))
+"""
+
+def measure(module, runs):
+  """Returns list of import times (ms) and set of eagerly loaded heavy modules"""
+  times, loaded = [], set()
+  for _ in range(runs):
+    out = subprocess.check_output([sys.executable, '-c', PROBE.format(module, LAZY_MODULES)], cwd=ROOT)
+    elapsed, _, eager = out.decode('utf-8').strip().partition(' ')
+    times.append(float(elapsed))
+    loaded.update(m for m in eager.split(',') if m)
+  return times, loaded
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('modules', nargs='*', default=['ispras.texterra', 'ispras.twitter'])
+  parser.add_argument('--runs', type=int, default=10)
+  parser.add_argument('--max-ms', type=float, default=None)
+  args = parser.parse_args()
+
+  failed = False
+  for module in args.modules:
+    times, loaded = measure(module, args.runs)
+    times.sort()
+    median = times[len(times) // 2]
+    print('{0:20} median {1:8.2f} ms  min {2:8.2f} ms  max {3:8.2f} ms'.format(module, median, times[0], times[-1]))
+    if loaded:
+      print('  eagerly loaded: {0}'.format(', '.join(sorted(loaded))))
+      failed = True
+    if args.max_ms is not None and median > args.max_ms:
+      print('  median exceeds {0} ms'.format(args.max_ms))
+      failed = True
+  return 1 if failed else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Client-side load balancing over service replicas"""
+import random
+import threading
+import time
+
+class Host(object):
+  def __init__(self, url):
+    self.url = url
+    self.outstanding = 0
+    self.requests = 0
+    self.failures = 0
+    self.consecutiveFailures = 0
+    self.ewma = None
+    self.ejectedUntil = 0
+    self.ejectedFor = None
+    self.session = None
+
+  def ejected(self, now):
+    return self.ejectedUntil > now
+
+  def eject(self, until, reason):
+    self.ejectedUntil = until
+    self.ejectedFor = reason
+
+  def reinstate(self):
+    # Latency estimate of slow replica is stale, it is measured anew
+    if self.ejectedFor == 'slow':
+      self.ewma = None
+    self.ejectedUntil = 0
+    self.ejectedFor = None
+
+class HostPool(object):
+  """Picks replica for each call by least outstanding requests ('least-outstanding')
+    or by latency EWMA weighted with outstanding requests ('ewma').
+    Replicas failing ejectAfter calls in a row, or slower than slowFactor times the median of others,
+    are ejected for ejectFor seconds. Health checks GET url + healthPath of each replica every healthInterval seconds
+    in background, ejecting replicas that fail and reinstating failed ones that answer (status below 500).
+    Every replica has its own requests.Session with pool of poolSize connections.
+      t = texterra.API(key, host=['http://10.0.0.1:8082/texterra/', 'http://10.0.0.2:8082/texterra/'])"""
+
+  def __init__(self, urls, policy='least-outstanding', alpha=0.3, ejectAfter=3, ejectFor=30, slowFactor=3.0,
+               healthPath='', healthInterval=5.0, healthTimeout=2.0, poolSize=10):
+    if policy not in ('least-outstanding', 'ewma'):
+      raise ValueError('Unknown balancing policy {0}'.format(policy))
+    self.hosts = [Host(url) for url in urls]
+    self.policy = policy
+    self.alpha = alpha
+    self.ejectAfter = ejectAfter
+    self.ejectFor = ejectFor
+    self.slowFactor = slowFactor
+    self.healthPath = healthPath
+    self.healthInterval = healthInterval
+    self.healthTimeout = healthTimeout
+    self.poolSize = poolSize
+    self._lock = threading.Lock()
+    self._checker = None
+    self._closed = threading.Event()
+
+  def acquire(self, avoid=()):
+    """Returns Host for the next call, preferring hosts not in avoid; release() it when the call ends"""
+    if self._checker is None and self.healthInterval:
+      self._startChecks()
+    now = time.time()
+    with self._lock:
+      for h in self.hosts:
+        if h.ejectedFor is not None and not h.ejected(now):
+          h.reinstate()
+      candidates = [h for h in self.hosts if not h.ejected(now)] or self.hosts
+      candidates = [h for h in candidates if h not in avoid] or candidates
+      if self.policy == 'ewma':
+        cost = lambda h: (h.ewma or 0.0) * (h.outstanding + 1)
+      else:
+        cost = lambda h: h.outstanding
+      best = min(cost(h) for h in candidates)
+      host = random.choice([h for h in candidates if cost(h) == best])
+      host.outstanding += 1
+      host.requests += 1
+      if host.session is None:
+        host.session = self._session()
+      return host
+
+  def release(self, host, elapsed, ok):
+    """Records result of a call made on host"""
+    now = time.time()
+    with self._lock:
+      host.outstanding -= 1
+      if not ok:
+        host.failures += 1
+        host.consecutiveFailures += 1
+        if host.consecutiveFailures >= self.ejectAfter:
+          host.eject(now + self.ejectFor, 'failures')
+        return
+      host.consecutiveFailures = 0
+      host.ewma = elapsed if host.ewma is None else self.alpha * elapsed + (1 - self.alpha) * host.ewma
+      others = sorted(h.ewma for h in self.hosts if h is not host and h.ewma is not None and not h.ejected(now))
+      if others and host.ewma > self.slowFactor * others[len(others) // 2]:
+        host.eject(now + self.ejectFor, 'slow')
+
+  def cancel(self, host):
+    """Releases host acquired for a call that was not made, e.g. rejected by circuit breaker"""
+    with self._lock:
+      host.outstanding -= 1
+      host.requests -= 1
+
+  def _session(self):
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.poolSize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+  def _startChecks(self):
+    with self._lock:
+      if self._checker is None:
+        self._checker = threading.Thread(target=self._checkLoop, name='ispras-health-checks')
+        self._checker.daemon = True
+        self._checker.start()
+
+  def _checkLoop(self):
+    while not self._closed.wait(self.healthInterval):
+      self.check()
+
+  def check(self):
+    """Runs one round of health checks"""
+    for host in self.hosts:
+      with self._lock:
+        if host.session is None:
+          host.session = self._session()
+      try:
+        page = host.session.get(host.url + self.healthPath, timeout=self.healthTimeout)
+        page.close()
+        alive = page.status_code < 500
+      except Exception:
+        alive = False
+      with self._lock:
+        if not alive:
+          host.eject(time.time() + self.ejectFor, 'health')
+        elif host.ejectedFor in ('failures', 'health'):
+          # Slow replicas answer health checks too, they wait for the end of ejection
+          host.consecutiveFailures = 0
+          host.reinstate()
+
+  def close(self):
+    self._closed.set()
+    for host in self.hosts:
+      if host.session is not None:
+        host.session.close()
+
+  def metrics(self):
+    now = time.time()
+    with self._lock:
+      return dict((h.url, {
+        'outstanding': h.outstanding,
+        'requests': h.requests,
+        'failures': h.failures,
+        'latency': h.ewma,
+        'ejected': h.ejected(now)
+      }) for h in self.hosts)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Micro-batching of short texts into single NLP requests"""
+import bisect
+import threading
+import time
+
+class _Submission(object):
+  def __init__(self, text, lane):
+    self.text = text
+    self.lane = lane
+    self.size = len(text.encode('utf-8'))
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+class NLPBatcher(object):
+  """Collects texts submitted from many threads for up to maxDelay seconds or maxBytes bytes,
+    annotates them with one request and splits annotations back with rebased offsets.
+    Up to maxInFlight batches are sent at once, the next batch fills up while earlier ones are in flight.
+    Only methods with sentence-local output (see 'sentenceLocal' in NLPSpecs) can be batched."""
+
+  def __init__(self, api, methodName, maxDelay=0.01, maxBytes=16384, separator='\n\n', maxInFlight=4):
+    specs = api.NLPSpecs[methodName]
+    if not specs.get('sentenceLocal'):
+      raise ValueError('{0} output is not local to sentences and can not be batched'.format(methodName))
+    self.api = api
+    self.methodName = methodName
+    self.specs = specs
+    self.maxDelay = maxDelay
+    self.maxBytes = maxBytes
+    self.separator = separator
+    self.maxInFlight = maxInFlight
+    self._inFlight = threading.BoundedSemaphore(maxInFlight)
+    self._pool = None
+    self._cond = threading.Condition()
+    self._pending = []
+    self._pendingSize = 0
+    self._thread = None
+    self._closed = False
+
+  def annotate(self, text):
+    """Blocks until text is annotated, returns Texterra document just like <method>Annotate does"""
+    scheduler = self.api.scheduler
+    submission = _Submission(text, scheduler.current() if scheduler is not None else None)
+    with self._cond:
+      if self._closed:
+        raise RuntimeError('Batcher is closed')
+      self._pending.append(submission)
+      self._pendingSize += submission.size
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='ispras-nlp-batcher')
+        self._thread.daemon = True
+        self._thread.start()
+      self._cond.notify()
+    submission.done.wait()
+    if submission.error is not None:
+      raise submission.error
+    return submission.result
+
+  def close(self):
+    """Sends pending texts and stops background threads"""
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    if self._thread is not None:
+      self._thread.join()
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+
+  def _next(self):
+    """Waits for batch to fill up or for its deadline, returns list of submissions"""
+    with self._cond:
+      while not self._pending and not self._closed:
+        self._cond.wait()
+      if not self._pending:
+        return None
+      deadline = time.time() + self.maxDelay
+      while self._pendingSize < self.maxBytes and not self._closed:
+        left = deadline - time.time()
+        if left <= 0:
+          break
+        self._cond.wait(left)
+      batch, size = [], 0
+      while self._pending and (not batch or size + self._pending[0].size <= self.maxBytes):
+        submission = self._pending.pop(0)
+        size += submission.size
+        batch.append(submission)
+      self._pendingSize -= size
+      return batch
+
+  def _run(self):
+    from multiprocessing.pool import ThreadPool
+    self._pool = ThreadPool(self.maxInFlight)
+    while True:
+      # Batch is taken only when it can be sent, so it keeps filling up while all senders are busy
+      self._inFlight.acquire()
+      batch = self._next()
+      if batch is None:
+        self._inFlight.release()
+        return
+      self._pool.apply_async(self._deliver, (batch,))
+
+  def _deliver(self, batch):
+    try:
+      self._send(batch)
+    except Exception as e:
+      for submission in batch:
+        if not submission.done.is_set():
+          submission.error = e
+          submission.done.set()
+    finally:
+      self._inFlight.release()
+
+  def _request(self, text, lane):
+    if lane is None:
+      return self.api.POSTDocument(self.specs['path'], self.specs['params'], {'text': text}, 'json', name=self.methodName)
+    with self.api.scheduler.lane(lane):
+      return self.api.POSTDocument(self.specs['path'], self.specs['params'], {'text': text}, 'json', name=self.methodName)
+
+  def _send(self, batch):
+    starts, pos = [], 0
+    for submission in batch:
+      starts.append(pos)
+      pos += len(submission.text) + len(self.separator)
+    # Batch goes in the heaviest lane of its texts, so that interactive texts are not held back by bulk ones
+    lanes = [s.lane for s in batch if s.lane is not None]
+    lane = max(lanes, key=lambda name: self.api.scheduler.lanes[name].weight) if lanes else None
+    document = self._request(self.separator.join(s.text for s in batch), lane)
+
+    # Annotations crossing separator mean that texts were not independent, those are resent alone
+    parts = [dict((k, []) for k in document['annotations']) for _ in batch]
+    crossed = set()
+    for k, v in document['annotations'].items():
+      for an in v:
+        i = bisect.bisect_right(starts, an['start']) - 1
+        offset = starts[i]
+        if an['start'] >= offset + len(batch[i].text):
+          continue
+        if an['end'] > offset + len(batch[i].text):
+          crossed.add(i)
+          continue
+        an['start'] -= offset
+        an['end'] -= offset
+        parts[i][k].append(an)
+
+    for i, submission in enumerate(batch):
+      if i in crossed:
+        result = self._request(submission.text, submission.lane)
+      else:
+        result = dict((k, v) for k, v in document.items() if k != 'annotations')
+        result['text'] = submission.text
+        result['annotations'] = parts[i]
+      for k, v in result['annotations'].items():
+        for an in v:
+          an['text'] = submission.text[an['start']:an['end']]
+          an['annotated-text'] = submission.text
+      submission.result = result
+      submission.done.set()
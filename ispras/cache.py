@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Persistent response cache shared by processes"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+class DiskCache(object):
+  """SQLite backed cache of compressed responses with TTL and size cap.
+    Any number of threads and processes can share one file; when its size exceeds maxBytes,
+    expired and then least recently used entries are deleted down to 90% of maxBytes.
+    Set it as client cache to serve repeated requests from disk:
+      t.cache = DiskCache('/var/cache/texterra.sqlite', ttl=7 * 86400)"""
+
+  # Size is checked every compactEvery writes of a process
+  compactEvery = 64
+
+  def __init__(self, path, ttl=86400, maxBytes=256 * 1024 * 1024, level=6):
+    self.path = path
+    self.ttl = ttl
+    self.maxBytes = maxBytes
+    self.level = level
+    self.hits = 0
+    self.misses = 0
+    self._writes = 0
+    self._local = threading.local()
+    with self._connection() as db:
+      db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL)')
+      db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+  def _connection(self):
+    # Connections can not be shared between threads or inherited by forked processes
+    db = getattr(self._local, 'db', None)
+    if db is None or self._local.pid != os.getpid():
+      db = sqlite3.connect(self.path, timeout=30)
+      db.execute('PRAGMA journal_mode=WAL')
+      db.execute('PRAGMA synchronous=NORMAL')
+      self._local.db, self._local.pid = db, os.getpid()
+    return db
+
+  def key(self, method, url, params, format, body):
+    """Content address of request: sha256 of its canonical form, apikey excluded"""
+    params = sorted((k, v) for k, v in params.items() if k != 'apikey')
+    canonical = json.dumps([method, url, params, format, body], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+  def get(self, key):
+    """Returns cached bytes or None"""
+    now = time.time()
+    with self._connection() as db:
+      row = db.execute('SELECT value FROM responses WHERE key = ? AND expires > ?', (key, now)).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+    self.hits += 1
+    return zlib.decompress(row[0])
+
+  def put(self, key, value, ttl=None):
+    """Stores bytes for ttl seconds (cache default if None)"""
+    now = time.time()
+    data = zlib.compress(value, self.level)
+    with self._connection() as db:
+      db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+        (key, sqlite3.Binary(data), len(data), now + (self.ttl if ttl is None else ttl), now))
+    self._writes += 1
+    if self._writes % self.compactEvery == 0:
+      self.compact()
+
+  def compact(self):
+    """Deletes expired entries, then least recently used ones while cache exceeds maxBytes"""
+    with self._connection() as db:
+      db.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+      total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+      if total <= self.maxBytes:
+        return
+      excess = total - int(self.maxBytes * 0.9)
+      for key, size in db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+        if excess <= 0:
+          break
+        db.execute('DELETE FROM responses WHERE key = ?', (key,))
+        excess -= size
+
+  def clear(self):
+    with self._connection() as db:
+      db.execute('DELETE FROM responses')
+
+  def metrics(self):
+    with self._connection() as db:
+      entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+    return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
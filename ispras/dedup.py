@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Collapsing of near-duplicate texts before annotation"""
+import re
+import copy
+import bisect
+from difflib import SequenceMatcher
+
+SPACES = re.compile(r'\s+', re.UNICODE)
+MASK = (1 << 64) - 1
+
+def signature(text, numPerm=128, shingle=5):
+  """MinHash signature of character shingles of text: one permutation hashing with numPerm bins,
+    empty bins are filled from the next non-empty one. Uses built-in hash, so signatures are valid within the process"""
+  text = SPACES.sub(' ', text.lower()).strip()
+  shingles = set(text[i:i + shingle] for i in range(max(len(text) - shingle + 1, 1)))
+  bins = [None] * numPerm
+  for h in map(hash, shingles):
+    h &= MASK
+    b = h % numPerm
+    if bins[b] is None or h < bins[b]:
+      bins[b] = h
+  for b in range(numPerm):
+    step = 1
+    while bins[b] is None:
+      following = bins[(b + step) % numPerm]
+      if following is not None:
+        bins[b] = (following + step) & MASK
+      step += 1
+  return bins
+
+def similarity(first, second):
+  """Estimated Jaccard similarity of two signatures"""
+  return sum(1 for a, b in zip(first, second) if a == b) / float(len(first))
+
+def collapse(texts, keys=None, threshold=0.8, numPerm=128, bands=32, shingle=5):
+  """Returns list of representative indices: i-th text is replaced by texts[result[i]].
+    Texts are grouped with LSH over bands of signatures, then estimated similarity is checked.
+    Texts with different keys (if provided) are never grouped, equal texts of equal keys always are"""
+  rows = numPerm // bands
+  exact, buckets, signatures, result = {}, {}, {}, []
+  for i, text in enumerate(texts):
+    key = keys[i] if keys is not None else None
+    if (key, text) in exact:
+      result.append(exact[(key, text)])
+      continue
+    sig = signature(text, numPerm, shingle)
+    found = None
+    for band in range(bands):
+      for j in buckets.get((key, band, tuple(sig[band * rows:(band + 1) * rows])), ()):
+        if similarity(sig, signatures[j]) >= threshold:
+          found = j
+          break
+      if found is not None:
+        break
+    if found is None:
+      found = i
+      signatures[i] = sig
+      for band in range(bands):
+        buckets.setdefault((key, band, tuple(sig[band * rows:(band + 1) * rows])), []).append(i)
+    exact[(key, text)] = found
+    result.append(found)
+  return result
+
+class NearDuplicates(object):
+  """Annotates lists of texts with one request per group of near-duplicates, method(text) returns Texterra document.
+    Annotations of the representative are moved to each duplicate along aligned equal parts of the texts,
+    annotations of the whole text are kept, others that touch changed parts are dropped.
+    With verify set, a duplicate with such annotations is annotated on its own instead.
+    Exact duplicates get the representative result as is."""
+
+  def __init__(self, method, threshold=0.8, numPerm=128, bands=32, shingle=5, verify=False):
+    self.method = method
+    self.threshold = threshold
+    self.numPerm = numPerm
+    self.bands = bands
+    self.shingle = shingle
+    self.verify = verify
+    self.texts = 0
+    self.requests = 0
+    self.dropped = 0
+
+  def annotate(self, texts):
+    """Returns list of Texterra documents for texts"""
+    representatives = collapse(texts, None, self.threshold, self.numPerm, self.bands, self.shingle)
+    documents = {}
+    result = []
+    for i, text in enumerate(texts):
+      self.texts += 1
+      r = representatives[i]
+      if r not in documents:
+        self.requests += 1
+        documents[r] = self.method(texts[r])
+      if texts[r] == text:
+        result.append(documents[r] if r == i else copy.deepcopy(documents[r]))
+        continue
+      document = self._align(texts[r], documents[r], text)
+      if document is None:
+        self.requests += 1
+        document = self.method(text)
+      result.append(document)
+    return result
+
+  def _align(self, source, document, text):
+    blocks = SequenceMatcher(None, source, text, autojunk=False).get_matching_blocks()
+    starts = [b.a for b in blocks]
+    annotations = {}
+    for k, v in document['annotations'].items():
+      moved = annotations.setdefault(k, [])
+      for an in v:
+        if an['start'] == 0 and an['end'] == len(source):
+          start, end = 0, len(text)
+        else:
+          block = blocks[bisect.bisect_right(starts, an['start']) - 1]
+          if an['start'] < block.a or an['end'] > block.a + block.size:
+            if self.verify:
+              return None
+            self.dropped += 1
+            continue
+          start, end = an['start'] - block.a + block.b, an['end'] - block.a + block.b
+        an = copy.deepcopy(an)
+        an['start'], an['end'] = start, end
+        an['text'] = text[start:end]
+        an['annotated-text'] = text
+        moved.append(an)
+    result = dict((k, v) for k, v in document.items() if k != 'annotations')
+    result['text'] = text
+    result['annotations'] = annotations
+    return result
+
+  def metrics(self):
+    return {'texts': self.texts, 'requests': self.requests, 'dropped': self.dropped}
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Byte budget of calls in flight"""
+import threading
+import time
+from collections import deque
+
+def requestSize(kwargs):
+  """Estimated size (bytes) of request body from keyword arguments of the call"""
+  return sizeOf(kwargs.get('data')) + sizeOf(kwargs.get('json'))
+
+def sizeOf(value):
+  if value is None:
+    return 0
+  if isinstance(value, dict):
+    return sum(sizeOf(k) + sizeOf(v) for k, v in value.items())
+  if isinstance(value, (list, tuple)):
+    return sum(sizeOf(v) for v in value)
+  if hasattr(value, '__len__'):
+    return len(value)
+  return 8
+
+class Hold(object):
+  def __init__(self, budget, size):
+    self.budget = budget
+    self.size = size
+    self.active = True
+
+  def grow(self, size):
+    """Adds observed bytes, e.g. of response, to the hold"""
+    self.budget._grow(self, size)
+
+  def release(self):
+    self.budget._release(self)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.release()
+
+class ByteBudget(object):
+  """Limits total bytes held by calls in flight: request body when the call starts, response content when it arrives,
+    each multiplied by expansion to account for encoded copies and parsed results. Calls that do not fit wait in
+    arrival order until earlier calls release their bytes; a call bigger than the whole budget runs alone.
+    Responses of calls already in flight are always accepted, so usage may exceed maxBytes until they end.
+      t.budget = ByteBudget(maxBytes=256 * 1024 * 1024)"""
+
+  def __init__(self, maxBytes=256 * 1024 * 1024, expansion=3):
+    self.maxBytes = maxBytes
+    self.expansion = expansion
+    self.used = 0
+    self.peak = 0
+    self.holds = 0
+    self.waits = 0
+    self.waitTime = 0.0
+    self._queue = deque()
+    self._cond = threading.Condition()
+
+  def hold(self, size, deadline=None):
+    """Blocks until size bytes fit into budget, returns Hold to be released when the call ends.
+      Raises requests.exceptions.Timeout if they do not fit before deadline (time.time() value)"""
+    size *= self.expansion
+    with self._cond:
+      if self._queue or (self.used and self.used + size > self.maxBytes):
+        self.waits += 1
+        start = time.time()
+        ticket = object()
+        self._queue.append(ticket)
+        try:
+          while self._queue[0] is not ticket or (self.used and self.used + size > self.maxBytes):
+            left = deadline - time.time() if deadline is not None else None
+            if left is not None and left <= 0:
+              import requests
+              raise requests.exceptions.Timeout('Deadline exceeded waiting for byte budget')
+            self._cond.wait(left)
+        finally:
+          self._queue.remove(ticket)
+          self._cond.notify_all()
+        self.waitTime += time.time() - start
+      self._take(size)
+      self.holds += 1
+      return Hold(self, size)
+
+  def _take(self, size):
+    self.used += size
+    self.peak = max(self.peak, self.used)
+
+  def _grow(self, hold, size):
+    size *= self.expansion
+    with self._cond:
+      hold.size += size
+      self._take(size)
+
+  def _release(self, hold):
+    with self._cond:
+      if not hold.active:
+        return
+      hold.active = False
+      self.used -= hold.size
+      self.holds -= 1
+      hold.size = 0
+      self._cond.notify_all()
+
+  def metrics(self):
+    with self._cond:
+      return {
+        'maxBytes': self.maxBytes,
+        'inFlight': self.used,
+        'peak': self.peak,
+        'calls': self.holds,
+        'waiting': len(self._queue),
+        'waits': self.waits,
+        'waitTime': self.waitTime
+      }
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Compact local store of harvested knowledge base subgraphs"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from .records import Concept
+
+MAGIC = b'ISPRASG1'
+# Node count, edge count, attribute blob size, little endian flag
+HEADER = struct.Struct('<qqqq')
+
+class GraphStore(object):
+  """Concept graph with interned concept ids, CSR adjacency and attribute columns.
+    Nodes are kept in sorted id array, node i has neighbours targets[offsets[i]:offsets[i + 1]] (node indices).
+    Edges and attributes are added to pending part, build() merges them into arrays.
+    Saved store is memory-mapped by load() without reading it into memory.
+    Neighbours of nodes that were never expanded are requested with fetch(concepts) of at most chunkSize concepts,
+    which returns list of (source Concept, list of neighbour Concepts), if it is provided."""
+
+  def __init__(self, kb=None, fetch=None, chunkSize=50):
+    self.kb = kb
+    self.fetch = fetch
+    self.chunkSize = chunkSize
+    self._ids = array('q')
+    self._offsets = array('q', [0])
+    self._targets = array('q')
+    self._expanded = array('b')
+    self._columns = {}
+    self._pending = {}
+    self._pendingAttributes = {}
+    self._mmap = None
+    self.fetched = 0
+
+  def __len__(self):
+    return len(self._ids) + sum(1 for ident in self._pending if self._index(ident) is None)
+
+  def addNeighbours(self, source, targets):
+    """Adds edges from source id to each of target ids, source becomes expanded"""
+    self._pending.setdefault(source, set()).update(targets)
+
+  def addEdges(self, edges):
+    """Adds records.Edge records, e.g. from texterra.API.traverseNeighbours"""
+    for edge in edges:
+      self.addNeighbours(edge.source.id, [edge.target.id])
+
+  def addGroups(self, groups):
+    """Adds (source Concept, list of neighbour Concepts) groups"""
+    for source, targets in groups:
+      self.addNeighbours(source.id, [target.id for target in targets])
+
+  def addAttributes(self, items):
+    """Adds records.ConceptAttributes records"""
+    for item in items:
+      self._pendingAttributes.setdefault(item.id, {}).update(item.attributes)
+
+  def _index(self, ident):
+    i = bisect.bisect_left(self._ids, ident)
+    return i if i < len(self._ids) and self._ids[i] == ident else None
+
+  def _stored(self, i):
+    return [self._ids[t] for t in self._targets[self._offsets[i]:self._offsets[i + 1]]]
+
+  def build(self):
+    """Merges pending edges and attributes into arrays"""
+    if not self._pending and not self._pendingAttributes:
+      return self
+    adjacency, expanded = {}, set()
+    for i, ident in enumerate(self._ids):
+      adjacency[ident] = set(self._stored(i))
+      if self._expanded[i]:
+        expanded.add(ident)
+    for ident, targets in self._pending.items():
+      adjacency.setdefault(ident, set()).update(targets)
+      expanded.add(ident)
+      for target in targets:
+        adjacency.setdefault(target, set())
+    attributes = dict((ident, self.attributes(ident)) for ident in self._ids)
+    for ident, values in self._pendingAttributes.items():
+      adjacency.setdefault(ident, set())
+      attributes.setdefault(ident, {}).update(values)
+
+    ids = array('q', sorted(adjacency))
+    index = dict((ident, i) for i, ident in enumerate(ids))
+    offsets, targets = array('q', [0]), array('q')
+    for ident in ids:
+      targets.extend(sorted(index[t] for t in adjacency[ident]))
+      offsets.append(len(targets))
+    columns = {}
+    for ident, values in attributes.items():
+      for name, value in values.items():
+        columns.setdefault(name, [None] * len(ids))[index[ident]] = value
+    self._ids, self._offsets, self._targets = ids, offsets, targets
+    self._expanded = array('b', [ident in expanded for ident in ids])
+    self._columns = columns
+    self._pending, self._pendingAttributes = {}, {}
+    self._mmap = None
+    return self
+
+  def known(self, ident):
+    """Whether neighbours of concept id are stored"""
+    i = self._index(ident)
+    return ident in self._pending or (i is not None and bool(self._expanded[i]))
+
+  def expand(self, idents):
+    """Fetches neighbours of those concept ids that were never expanded with fetch calls of chunkSize concepts,
+      if fetch is provided"""
+    unknown = [ident for ident in idents if not self.known(ident)]
+    if self.fetch is None:
+      return
+    for i in range(0, len(unknown), self.chunkSize):
+      chunk = unknown[i:i + self.chunkSize]
+      self.fetched += 1
+      self.addGroups(self.fetch([Concept(ident, self.kb) for ident in chunk]))
+      for ident in chunk:
+        self._pending.setdefault(ident, set())
+
+  def neighbours(self, ident):
+    """Returns list of neighbour ids of concept id, fetching them if they are unknown"""
+    self.expand([ident])
+    if not self.known(ident):
+      raise KeyError('Neighbours of {0} are unknown'.format(ident))
+    i = self._index(ident)
+    result = self._stored(i) if i is not None else []
+    if ident in self._pending:
+      result = sorted(set(result) | self._pending[ident])
+    return result
+
+  def degree(self, ident):
+    return len(self.neighbours(ident))
+
+  def khop(self, ident, k):
+    """Returns {id: depth} of concepts within k hops from concept id.
+      Unknown neighbours of each frontier are fetched together in chunks; concepts whose neighbours
+      stay unknown (no fetch) are boundary of the stored graph, they are included but not expanded"""
+    depths, frontier = {ident: 0}, [ident]
+    for depth in range(1, k + 1):
+      self.expand(frontier)
+      following = []
+      for node in frontier:
+        if not self.known(node):
+          continue
+        for target in self.neighbours(node):
+          if target not in depths:
+            depths[target] = depth
+            following.append(target)
+      frontier = following
+    return depths
+
+  def attributes(self, ident):
+    """Returns dict of stored attributes of concept id"""
+    i = self._index(ident)
+    result = {}
+    if i is not None:
+      for name, column in self._columns.items():
+        if column[i] is not None:
+          result[name] = column[i]
+    result.update(self._pendingAttributes.get(ident, {}))
+    return result
+
+  def save(self, path):
+    """Writes built arrays to file, pending part is built first.
+      Arrays may be mapped from the same file, so it is written aside and then moved into place"""
+    self.build()
+    blob = json.dumps({'kb': self.kb, 'columns': self._columns, 'expanded': self._expanded.tolist()}).encode('utf-8')
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(len(self._ids), len(self._targets), len(blob), sys.byteorder == 'little'))
+        for data in (self._ids, self._offsets, self._targets):
+          f.write(data.tobytes() if hasattr(data, 'tobytes') else data.tostring())
+        f.write(blob)
+      getattr(os, 'replace', os.rename)(temporary, path)
+    except Exception:
+      os.remove(temporary)
+      raise
+
+  @classmethod
+  def load(cls, path, fetch=None, chunkSize=50):
+    """Memory-maps store saved by save()"""
+    with open(path, 'rb') as f:
+      mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+      raise ValueError('{0} is not a graph store file'.format(path))
+    n, m, blobSize, little = HEADER.unpack_from(mapped, len(MAGIC))
+    pos = len(MAGIC) + HEADER.size
+    sections = []
+    for size in (n, n + 1, m):
+      sections.append(cls._array(mapped, pos, size, little))
+      pos += 8 * size
+    meta = json.loads(mapped[pos:pos + blobSize].decode('utf-8'))
+    store = cls(meta['kb'], fetch, chunkSize)
+    store._ids, store._offsets, store._targets = sections
+    store._expanded = array('b', meta['expanded'])
+    store._columns = meta['columns']
+    store._mmap = mapped
+    return store
+
+  @staticmethod
+  def _array(mapped, pos, size, little):
+    if little == (sys.byteorder == 'little') and hasattr(memoryview, 'cast'):
+      return memoryview(mapped)[pos:pos + 8 * size].cast('q')
+    data = array('q')
+    data.frombytes(mapped[pos:pos + 8 * size]) if hasattr(data, 'frombytes') else data.fromstring(mapped[pos:pos + 8 * size])
+    if little != (sys.byteorder == 'little'):
+      data.byteswap()
+    return data
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Hedged requests for idempotent API calls"""
+import threading
+import time
+from collections import deque
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+class Hedger(object):
+  """Sends second copy of a call that has not completed within percentile of recent latencies,
+    the first successful response wins and the other one is closed as soon as it arrives.
+    Hedges are limited to budget fraction of calls and start after minSamples calls are measured.
+    Only set it for idempotent calls, which all Texterra and Twitter NLP calls are:
+      t.hedger = Hedger(percentile=95, budget=0.05)"""
+
+  def __init__(self, percentile=95, budget=0.05, minSamples=20, minDelay=0.005, window=1000):
+    self.percentile = percentile
+    self.budget = budget
+    self.minSamples = minSamples
+    self.minDelay = minDelay
+    self._latencies = deque(maxlen=window)
+    self._lock = threading.Lock()
+    self.calls = 0
+    self.hedges = 0
+    self.wins = 0
+
+  def delay(self):
+    """Seconds to wait before hedging, None while there are too few measurements"""
+    with self._lock:
+      if len(self._latencies) < self.minSamples:
+        return None
+      ordered = sorted(self._latencies)
+    return max(self.minDelay, ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))])
+
+  def _allow(self):
+    with self._lock:
+      if self.hedges + 1 > self.budget * self.calls:
+        return False
+      self.hedges += 1
+      return True
+
+  def run(self, call):
+    """Runs call(attempt) with attempt 0, and with attempt 1 if it is hedged; returns first successful result"""
+    with self._lock:
+      self.calls += 1
+    results = queue.Queue()
+
+    def attempt(number):
+      started = time.time()
+      try:
+        result = call(number)
+      except Exception as e:
+        results.put((number, None, e))
+        return
+      with self._lock:
+        self._latencies.append(time.time() - started)
+      results.put((number, result, None))
+
+    def launch(number):
+      thread = threading.Thread(target=attempt, args=(number,), name='ispras-hedge')
+      thread.daemon = True
+      thread.start()
+
+    launch(0)
+    launched, outcome = 1, None
+    delay = self.delay()
+    if delay is not None:
+      try:
+        outcome = results.get(timeout=delay)
+      except queue.Empty:
+        if self._allow():
+          launch(1)
+          launched = 2
+    if outcome is None:
+      outcome = results.get()
+    received = 1
+    while outcome[2] is not None and received < launched:
+      outcome = results.get()
+      received += 1
+    if received < launched:
+      def discard():
+        number, result, error = results.get()
+        if result is not None and hasattr(result, 'close'):
+          result.close()
+      discarding = threading.Thread(target=discard, name='ispras-hedge-discard')
+      discarding.daemon = True
+      discarding.start()
+    if outcome[0] == 1 and outcome[2] is None:
+      with self._lock:
+        self.wins += 1
+    if outcome[2] is not None:
+      raise outcome[2]
+    return outcome[1]
+
+  def metrics(self):
+    return {'calls': self.calls, 'hedges': self.hedges, 'wins': self.wins, 'delay': self.delay()}
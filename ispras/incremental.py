@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Incremental re-annotation of edited documents"""
+import bisect
+import re
+import threading
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+# Units cover whole text, trailing separators belong to the unit
+UNITS = {
+  'paragraph': re.compile(r'[^\n]*\n+|[^\n]+$'),
+  'sentence': re.compile(r'[^\n]*?(?:[.!?]+\s+|\n+)|[^\n]+$')
+}
+
+def split(text, granularity='paragraph'):
+  """Returns list of (start, end) spans of paragraphs or sentences covering text"""
+  return [m.span() for m in UNITS[granularity].finditer(text) if m.end() > m.start()]
+
+class IncrementalAnnotator(object):
+  """Re-annotates edited versions of documents by diffing them with previous versions of the same key.
+    Annotations of unchanged paragraphs (or sentences) are reused with shifted offsets,
+    changed ones are sent to method(text), which returns Texterra document.
+    The result equals full re-annotation for methods with output local to the unit."""
+
+  def __init__(self, method, granularity='paragraph', maxDocuments=128):
+    self.method = method
+    self.granularity = granularity
+    self.maxDocuments = maxDocuments
+    self._documents = OrderedDict()
+    self._lock = threading.Lock()
+    self.reusedUnits = 0
+    self.annotatedUnits = 0
+    self.requests = 0
+
+  def annotate(self, key, text):
+    """Returns Texterra document for text, which is a new version of document key"""
+    with self._lock:
+      previous = self._documents.pop(key, None)
+    if previous is None or previous[0] == text:
+      if previous is None:
+        self.requests += 1
+        self.annotatedUnits += len(split(text, self.granularity))
+        document = self.method(text)
+      else:
+        self.reusedUnits += len(split(text, self.granularity))
+        document = previous[1]
+    else:
+      document = self._update(previous[0], previous[1], text)
+    with self._lock:
+      self._documents[key] = (text, document)
+      while len(self._documents) > self.maxDocuments:
+        self._documents.popitem(last=False)
+    return document
+
+  def forget(self, key):
+    with self._lock:
+      self._documents.pop(key, None)
+
+  def _update(self, oldText, oldDocument, text):
+    oldSpans, newSpans = split(oldText, self.granularity), split(text, self.granularity)
+    matcher = SequenceMatcher(None, [oldText[a:b] for a, b in oldSpans], [text[a:b] for a, b in newSpans], autojunk=False)
+    old = {}
+    for k, v in oldDocument['annotations'].items():
+      ordered = sorted(v, key=lambda an: an['start'])
+      old[k] = ([an['start'] for an in ordered], ordered)
+    annotations = dict((k, []) for k in old)
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+      if j1 == j2:
+        continue
+      newStart, newEnd = newSpans[j1][0], newSpans[j2 - 1][1]
+      if tag == 'equal':
+        self.reusedUnits += j2 - j1
+        oldStart, oldEnd = oldSpans[i1][0], oldSpans[i2 - 1][1]
+        shift = newStart - oldStart
+        for k, (starts, ordered) in old.items():
+          for an in ordered[bisect.bisect_left(starts, oldStart):bisect.bisect_left(starts, oldEnd)]:
+            if an['end'] <= oldEnd:
+              an = dict(an)
+              an['start'] += shift
+              an['end'] += shift
+              annotations[k].append(an)
+      else:
+        self.annotatedUnits += j2 - j1
+        region = text[newStart:newEnd]
+        if not region.strip():
+          continue
+        self.requests += 1
+        for k, v in self.method(region)['annotations'].items():
+          for an in v:
+            an['start'] += newStart
+            an['end'] += newStart
+            annotations.setdefault(k, []).append(an)
+
+    document = dict((k, v) for k, v in oldDocument.items() if k != 'annotations')
+    document['text'] = text
+    document['annotations'] = annotations
+    for k, v in annotations.items():
+      v.sort(key=lambda an: (an['start'], an['end']))
+      for an in v:
+        an['text'] = text[an['start']:an['end']]
+        an['annotated-text'] = text
+    return document
+
+  def metrics(self):
+    return {'reusedUnits': self.reusedUnits, 'annotatedUnits': self.annotatedUnits, 'requests': self.requests}
@@ -1,14 +1,36 @@
 # -*- coding: utf-8 -*-
-import xmltodict
-import requests
+import threading
+import time
+from contextlib import contextmanager
+from . import uploads
+from . import flowcontrol
+
+def decode(content, format, transform=None):
+  """Parses response content of given format, then applies transform(result) if it is provided.
+    Module level function, so that ParsePool can run it in worker processes"""
+  if format == 'xml':
+    import xmltodict
+    result = xmltodict.parse(content)
+  elif format == 'json':
+    import json
+    result = json.loads(content.decode('utf-8'))
+  else:
+    result = content.decode('utf-8')
+  return transform(result) if transform is not None else result
 
 class API(object):
   API_URL = 'http://api.ispras.ru/{0}/{1}/'
 
   def __init__(self, key=False, name=None, ver=None, host=None):
+    self.__local = threading.local()
+    self.__uploads = uploads.UploadMeter()
     if host:
       self.apikey = key
-      self.url = host
+      hosts = host.split(',') if hasattr(host, 'split') else list(host)
+      self.url = hosts[0]
+      if len(hosts) > 1:
+        from .balancing import HostPool
+        self.balancer = HostPool(hosts)
     else:
       import sys
       if len(key) == 40:
@@ -20,33 +42,253 @@ class API(object):
         print('Please provide proper apikey')
         sys.exit(0)
 
-  def GET(self, path, request_params, format='xml'):
-    """Method for invoking Ispras API GET request"""
-    url = self.url + path;
-    if self.apikey: request_params['apikey'] = self.apikey
-    page = requests.get(url, params=request_params, headers=self.__headers(format), timeout=60)
+  # LaneScheduler sharing concurrency budget between priority lanes, see scheduler module
+  scheduler = None
+  # DiskCache serving repeated requests, see cache module
+  cache = None
+  # CircuitBreaker failing fast on unavailable hosts, see resilience module
+  breaker = None
+  # Hedger sending second copy of slow calls, see hedging module
+  hedger = None
+  # ParsePool decoding responses in worker processes, see offload module
+  parsePool = None
+  # Profiler sampling calls, see profiling module
+  profiler = None
+  # Transport sending calls (requests.request if None), e.g. HTTP2Transport, see transport module
+  transport = None
+  # ByteBudget limiting bytes of calls in flight, see flowcontrol module
+  budget = None
+  # HostPool spreading calls over replicas, set when several hosts are given, see balancing module
+  balancer = None
+  # Encoding of POSTDocument bodies: 'form', 'json', 'raw' or 'multipart', see uploads module
+  upload = 'form'
+  # Timeouts (seconds) of connection and of waiting for response data
+  connectTimeout = 10
+  readTimeout = 60
+  # Deadlines (seconds) of calls by path prefix, e.g. {'nlp/polarity': 2.0}
+  deadlines = {}
+  # Repeats of calls failed with connection error, timeout or 5xx response, pause doubles from retryBackoff
+  retries = 0
+  retryBackoff = 0.1
+
+  def GET(self, path, request_params, format='xml', transform=None):
+    """Method for invoking Ispras API GET request.
+      transform(result) post-processes parsed result, it should be picklable to run in parsePool"""
+    return self.__request('get', path, request_params, format, transform)
+
+  def POST(self, path, request_params, form_params, format='xml', json=None, transform=None):
+    """Method for invoking Ispras API POST request.
+      If json is provided, it is sent as JSON body instead of form_params.
+      transform(result) post-processes parsed result, it should be picklable to run in parsePool"""
+    if json is not None:
+      return self.__request('post', path, request_params, format, transform, json=json)
+    return self.__request('post', path, request_params, format, transform, data=form_params)
+
+  def POSTDocument(self, path, request_params, form_params, format='xml', transform=None, name=None):
+    """Method for invoking Ispras API POST request with text fields encoded according to upload attribute.
+      Sent bytes and bytes of the same form url-encoded are counted by name (path by default) in metrics"""
+    kwargs, sent, form = uploads.encode(self.upload, form_params)
+    return self.__request('post', path, request_params, format, transform, (name or path, sent, form), **kwargs)
+
+  def POSTChunks(self, path, request_params, form_params, format='json', chunkSize=65536):
+    """Method for invoking Ispras API POST request with response read incrementally.
+      Returns generator of raw response chunks, connection is released when it is exhausted or closed"""
+    deadline = self.__deadline(path)
+    # Chunks are not kept, so request body is held in budget only until it is sent:
+    # a hold kept across yield would make calls of the consumer wait for it forever
+    if self.budget is not None:
+      with self.budget.hold(flowcontrol.requestSize({'data': form_params}), deadline):
+        page = self.__send('post', path, request_params, format, deadline, data=form_params, stream=True)
+    else:
+      page = self.__send('post', path, request_params, format, deadline, data=form_params, stream=True)
+    try:
+      if page.status_code != 200:
+        page.raise_for_status()
+      for chunk in page.iter_content(chunkSize):
+        yield chunk
+    finally:
+      page.close()
+
+  @contextmanager
+  def deadline(self, seconds):
+    """Bounds total time of calls made by current thread inside the block, retries included.
+      Nested deadlines can only shorten the outer one"""
+    previous = getattr(self.__local, 'deadline', None)
+    deadline = time.time() + seconds
+    self.__local.deadline = deadline if previous is None else min(previous, deadline)
+    try:
+      yield
+    finally:
+      self.__local.deadline = previous
+
+  def metrics(self):
+    """Returns metrics of client components"""
+    result = {}
+    if self.scheduler is not None:
+      result['lanes'] = self.scheduler.metrics()
+    if self.cache is not None:
+      result['cache'] = self.cache.metrics()
+    if self.breaker is not None:
+      result['breaker'] = self.breaker.metrics()
+    if self.hedger is not None:
+      result['hedging'] = self.hedger.metrics()
+    if self.parsePool is not None:
+      result['parsing'] = self.parsePool.metrics()
+    if self.profiler is not None:
+      result['profiling'] = self.profiler.metrics()
+    if self.balancer is not None:
+      result['hosts'] = self.balancer.metrics()
+    if self.budget is not None:
+      result['budget'] = self.budget.metrics()
+    uploaded = self.__uploads.metrics()
+    if uploaded:
+      result['uploads'] = uploaded
+    return result
+
+  def __request(self, method, path, request_params, format, transform, uploaded=None, **kwargs):
+    if self.profiler is not None and self.profiler.sample():
+      return self.profiler.profile(self, lambda: self.__fetch(method, path, request_params, format, transform, uploaded, **kwargs))
+    return self.__fetch(method, path, request_params, format, transform, uploaded, **kwargs)
+
+  def __fetch(self, method, path, request_params, format, transform, uploaded, **kwargs):
+    deadline = self.__deadline(path)
+    if self.budget is not None:
+      with self.budget.hold(flowcontrol.requestSize(kwargs), deadline) as held:
+        return self.__load(method, path, request_params, format, transform, deadline, held, uploaded, **kwargs)
+    return self.__load(method, path, request_params, format, transform, deadline, None, uploaded, **kwargs)
+
+  def __load(self, method, path, request_params, format, transform, deadline, held, uploaded, **kwargs):
+    if self.cache is not None:
+      key = self.cache.key(method, self.url + path, request_params, format, kwargs)
+      content = self.cache.get(key)
+      if content is not None:
+        if held is not None:
+          held.grow(len(content))
+        return self.__decode(content, format, transform)
+    page = self.__send(method, path, request_params, format, deadline, **kwargs)
+    # (name, sent, form) of POSTDocument body, counted only when it went to the wire
+    if uploaded is not None:
+      self.__uploads.record(*uploaded)
     if page.status_code == 200:
-      return self.__parse(page, format)
+      if held is not None:
+        held.grow(len(page.content))
+      if self.cache is not None:
+        self.cache.put(key, page.content)
+      return self.__decode(page.content, format, transform)
     else:
       page.raise_for_status()
 
-  def POST(self, path, request_params, form_params, format='xml'):
-    """Method for invoking Ispras API POST request"""
+  def __deadline(self, path):
+    """Utility computing deadline of a call from deadline block of current thread and deadlines attribute"""
+    deadline = getattr(self.__local, 'deadline', None)
+    for prefix, seconds in self.deadlines.items():
+      if path.startswith(prefix):
+        deadline = min(deadline or float('inf'), time.time() + seconds)
+    return deadline
+
+  def __send(self, method, path, request_params, format, deadline, **kwargs):
     url = self.url + path;
+    # Preset params are shared between calls and threads, so apikey goes to a copy
+    request_params = dict(request_params)
     if self.apikey: request_params['apikey'] = self.apikey
-    page = requests.post(url, params=request_params, headers=self.__headers(format), data=form_params, timeout=60)
-    if page.status_code == 200:
-      return self.__parse(page, format)
-    else:
-      page.raise_for_status()
+    import requests
+    from .resilience import CircuitOpenError
+    # Hedged attempts run in other threads, so lane of the caller is passed explicitly
+    lane = self.scheduler.current() if self.scheduler is not None else None
+    # Replicas used by attempts, so that hedge and retry go to another one
+    used = []
+    attempt = 0
+    while True:
+      self.__timeout(url, deadline)
+      call = lambda hedge: self.__call(method, url, request_params, format, deadline, lane, used, **kwargs)
+      try:
+        if self.hedger is not None and not kwargs.get('stream'):
+          page = self.hedger.run(call)
+        else:
+          page = call(0)
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        # Open circuits fail fast, they are not retried
+        if attempt >= self.retries or isinstance(e, CircuitOpenError):
+          raise
+      else:
+        if page.status_code < 500 or attempt >= self.retries:
+          return page
+        page.close()
+      pause = self.retryBackoff * 2 ** attempt
+      if deadline is not None:
+        pause = min(pause, max(deadline - time.time(), 0))
+      time.sleep(pause)
+      attempt += 1
 
-  def __parse(self, page, format):
-    if format == 'xml':
-      return xmltodict.parse(page.text)
-    elif format == 'json':
-      return page.json()
-    else:
-      return page.text
+  def __call(self, method, url, request_params, format, deadline, lane, used, **kwargs):
+    # Replica is picked after the wait for a slot, which is bounded by deadline too
+    if self.scheduler is not None:
+      with self.scheduler.slot(lane, deadline):
+        return self.__attempt(method, url, request_params, format, deadline, used, **kwargs)
+    return self.__attempt(method, url, request_params, format, deadline, used, **kwargs)
+
+  def __attempt(self, method, url, request_params, format, deadline, used, **kwargs):
+    import requests
+    timeout = self.__timeout(url, deadline)
+    headers = self.__headers(format)
+    headers.update(kwargs.pop('headers', {}))
+    send = requests.request if self.transport is None else self.transport.request
+    target, host = url, None
+    if self.balancer is not None:
+      host = self.__acquire(url, used)
+      target = host.url + url[len(self.url):]
+      if self.transport is None:
+        send = host.session.request
+    elif self.breaker is not None:
+      self.breaker.before(target)
+    start = time.time()
+    try:
+      page = send(method, target, params=request_params, headers=headers, timeout=timeout, **kwargs)
+    except Exception:
+      if host is not None:
+        self.balancer.release(host, time.time() - start, False)
+      if self.breaker is not None:
+        self.breaker.record(target, False)
+      raise
+    if host is not None:
+      self.balancer.release(host, time.time() - start, page.status_code < 500)
+    if self.breaker is not None:
+      self.breaker.record(target, page.status_code < 500)
+    return page
+
+  def __timeout(self, url, deadline):
+    """Utility returning (connect, read) timeouts of an attempt, cut to time left before deadline"""
+    if deadline is None:
+      return (self.connectTimeout, self.readTimeout)
+    left = deadline - time.time()
+    if left <= 0:
+      import requests
+      raise requests.exceptions.Timeout('Deadline exceeded for {0}'.format(url))
+    return (min(self.connectTimeout, left), min(self.readTimeout, left))
+
+  def __acquire(self, url, used):
+    # Replicas with open circuit are skipped, the call fails fast only when all of them are open
+    from .resilience import CircuitOpenError
+    rejected = []
+    while True:
+      host = self.balancer.acquire(used + rejected)
+      if self.breaker is None:
+        break
+      try:
+        self.breaker.before(host.url + url[len(self.url):])
+        break
+      except CircuitOpenError:
+        self.balancer.cancel(host)
+        if host in rejected:
+          raise
+        rejected.append(host)
+    used.append(host)
+    return host
+
+  def __decode(self, content, format, transform):
+    if self.parsePool is not None:
+      return self.parsePool.decode(content, format, transform)
+    return decode(content, format, transform)
 
   def __headers(self, format):
     headers = {}
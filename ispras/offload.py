@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Response parsing in worker processes"""
+import multiprocessing
+import threading
+from .ispras import decode
+
+class ParsePool(object):
+  """Runs decoding, parsing and post-processing of responses in a pool of worker processes,
+    so that parsing scales over cores and does not hold GIL of network threads.
+    Raw response bytes are sent to a worker and the parsed result is sent back.
+    Responses shorter than minBytes are parsed in place, as transfer would cost more than parsing.
+    Workers are started with startMethod ('spawn' by default), as forking a client running
+    hedging, health check and batching threads may copy their locks held and deadlock the workers.
+      t.parsePool = ParsePool(processes=4)"""
+
+  def __init__(self, processes=None, minBytes=16384, startMethod='spawn'):
+    self.processes = processes
+    self.minBytes = minBytes
+    self.startMethod = startMethod
+    self.offloaded = 0
+    self.inline = 0
+    self._pool = None
+    self._lock = threading.Lock()
+
+  def _workers(self):
+    with self._lock:
+      if self._pool is None:
+        # Python 2 has no start methods, there workers are forked
+        context = multiprocessing.get_context(self.startMethod) if hasattr(multiprocessing, 'get_context') else multiprocessing
+        self._pool = context.Pool(self.processes)
+      return self._pool
+
+  def decode(self, content, format, transform=None):
+    """Same as ispras.decode, but run in a worker process for large content"""
+    if len(content) < self.minBytes:
+      self.inline += 1
+      return decode(content, format, transform)
+    self.offloaded += 1
+    return self._workers().apply(decode, (content, format, transform))
+
+  def close(self):
+    with self._lock:
+      if self._pool is not None:
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+
+  def metrics(self):
+    return {'offloaded': self.offloaded, 'inline': self.inline}
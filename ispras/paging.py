@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Iteration over offset/limit paged results with background prefetch"""
+import threading
+import time
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+def iterPages(fetch, pageSize=50, prefetch=2, minPageSize=10, maxPageSize=1000, targetLatency=0.5):
+  """Yields items of all pages returned by fetch(offset, limit), which returns list of items.
+    Up to prefetch pages are requested in background while current one is consumed.
+    Page size is doubled while a page takes less than half of targetLatency seconds
+    and halved while it takes more than targetLatency. A short page shows that the service caps page size
+    unless it is shorter than a page the service has already returned in full, then it is the last one;
+    iteration also ends on empty page. Closing the generator stops background requests."""
+  pages = queue.Queue(prefetch)
+  stop = threading.Event()
+
+  def put(item):
+    while not stop.is_set():
+      try:
+        pages.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+
+  def produce():
+    offset, size, limit, honoured = 0, pageSize, maxPageSize, 0
+    try:
+      while not stop.is_set():
+        started = time.time()
+        items = fetch(offset, size)
+        elapsed = time.time() - started
+        put((items, None))
+        if not items or len(items) < honoured:
+          break
+        if len(items) < size:
+          limit = size = len(items)
+        honoured = max(honoured, len(items))
+        offset += len(items)
+        if elapsed < targetLatency / 2:
+          size = min(size * 2, limit)
+        elif elapsed > targetLatency:
+          size = max(size // 2, minPageSize)
+    except Exception as e:
+      put((None, e))
+      return
+    put((None, None))
+
+  producer = threading.Thread(target=produce, name='ispras-prefetch')
+  producer.daemon = True
+  producer.start()
+  try:
+    while True:
+      items, error = pages.get()
+      if error is not None:
+        raise error
+      if items is None:
+        return
+      for item in items:
+        yield item
+  finally:
+    stop.set()
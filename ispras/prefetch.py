@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Speculative prefetch of concept attributes"""
+import threading
+from collections import OrderedDict
+from .records import conceptsIn
+
+class AttributePrefetcher(object):
+  """Requests attributes of concepts found in disambiguation and key concepts results in background,
+    so that following getAttributes(concepts, kbname, atrList, format='json') with the same atrList
+    is served from memory. Calls for concepts still being fetched wait for that request.
+    At most maxPending concepts are fetched at once, others are dropped; capacity bounds stored concepts.
+      t.prefetcher = AttributePrefetcher(t, ['title', 'type'])"""
+
+  # Annotation classes whose concepts are prefetched
+  classes = ('disambiguated-phrase', 'keyconcepts')
+
+  def __init__(self, api, atrList=[], workers=2, chunkSize=50, maxPending=256, capacity=4096):
+    self.api = api
+    self.atrList = list(atrList)
+    self.workers = workers
+    self.chunkSize = chunkSize
+    self.maxPending = maxPending
+    self.capacity = capacity
+    self._stored = OrderedDict()
+    self._inflight = {}
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self._pool = None
+    self.prefetched = 0
+    self.dropped = 0
+    self.hits = 0
+    self.misses = 0
+
+  def observe(self, document):
+    """Starts prefetch of concepts annotated in Texterra document"""
+    byKb = OrderedDict()
+    for annotationClass in self.classes:
+      for an in document.get('annotations', {}).get(annotationClass, []):
+        for concept in conceptsIn(an.get('value')):
+          byKb.setdefault(concept.kb, OrderedDict())[concept.id] = True
+    for kb, ids in byKb.items():
+      self.schedule(list(ids), kb)
+
+  def schedule(self, ids, kb):
+    """Starts prefetch of attributes of concept ids of knowledge base kb"""
+    with self._lock:
+      fresh = [i for i in ids if (i, kb) not in self._stored and (i, kb) not in self._inflight]
+      room = max(self.maxPending - len(self._inflight), 0)
+      self.dropped += max(len(fresh) - room, 0)
+      fresh = fresh[:room]
+      if not fresh:
+        return
+      if self._pool is None:
+        from multiprocessing.pool import ThreadPool
+        self._pool = ThreadPool(self.workers, self._markWorker)
+      # Prefetch runs in lane of the call that found the concepts
+      fetch = self.api.scheduler.bind(self._fetch) if getattr(self.api, 'scheduler', None) is not None else self._fetch
+      for start in range(0, len(fresh), self.chunkSize):
+        chunk = fresh[start:start + self.chunkSize]
+        done = threading.Event()
+        for i in chunk:
+          self._inflight[(i, kb)] = done
+        self._pool.apply_async(fetch, (chunk, kb, done))
+
+  def _markWorker(self):
+    self._local.worker = True
+
+  def _fetch(self, chunk, kb, done):
+    try:
+      items = self.api.getAttributes(chunk, kb, self.atrList, format='json')
+    except Exception:
+      items = []
+    with self._lock:
+      for item in items:
+        self._stored.pop((item.id, kb), None)
+        self._stored[(item.id, kb)] = item
+      while len(self._stored) > self.capacity:
+        self._stored.popitem(last=False)
+      for i in chunk:
+        self._inflight.pop((i, kb), None)
+      self.prefetched += len(items)
+    done.set()
+
+  def lookup(self, ids, kb, atrList):
+    """Returns list of records.ConceptAttributes for concept ids if all of them are prefetched, None otherwise"""
+    if getattr(self._local, 'worker', False) or list(atrList) != self.atrList:
+      return None
+    with self._lock:
+      waiting = set(self._inflight[(i, kb)] for i in ids if (i, kb) in self._inflight)
+      missing = [i for i in ids if (i, kb) not in self._stored and (i, kb) not in self._inflight]
+      if missing:
+        self.misses += len(ids)
+        return None
+    for done in waiting:
+      done.wait()
+    with self._lock:
+      if not all((i, kb) in self._stored for i in ids):
+        self.misses += len(ids)
+        return None
+      self.hits += len(ids)
+      result = []
+      for i in ids:
+        item = self._stored.pop((i, kb))
+        self._stored[(i, kb)] = item
+        result.append(item)
+      return result
+
+  def metrics(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        'prefetched': self.prefetched,
+        'dropped': self.dropped,
+        'pending': len(self._inflight),
+        'hits': self.hits,
+        'misses': self.misses,
+        'hitRate': float(self.hits) / lookups if lookups else 0.0
+      }
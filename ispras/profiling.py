@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Sampling profiler of API calls"""
+import sys
+import random
+import threading
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+# Only one profiler can be active in the process (sys.monitoring since Python 3.12), calls of other threads are not sampled meanwhile
+_profiling = threading.Lock()
+
+class Profiler(object):
+  """Profiles a sampleRate fraction of API calls: request building, waiting for response, parsing and transform.
+    Each sampled call runs under cProfile and, if memory is set, under tracemalloc (Python 3 only).
+    Results are aggregated by logical method name, which is the outermost method of the client in the call stack,
+    e.g. 'texterra.namedEntities'. Memory tracing is process wide, so allocations of concurrent calls are mixed in.
+      t.profiler = Profiler(sampleRate=0.01, memory=True)
+      print(t.profiler.report(topN=20))"""
+
+  def __init__(self, sampleRate=0.01, memory=False, frames=1):
+    self.sampleRate = sampleRate
+    self.memory = memory and tracemalloc is not None
+    self.frames = frames
+    self._stats = {}
+    self._allocations = {}
+    self._sampled = {}
+    self._lock = threading.Lock()
+    self._tracing = 0
+    self.calls = 0
+
+  def sample(self):
+    """Whether the next call should be profiled"""
+    self.calls += 1
+    return random.random() < self.sampleRate and not _profiling.locked()
+
+  def profile(self, api, function):
+    """Returns function() run under profiler, results are attributed to the calling method of api"""
+    import cProfile
+    if not _profiling.acquire(False):
+      return function()
+    try:
+      name = self.methodName(api)
+      self._startTracing()
+      before = tracemalloc.take_snapshot() if self.memory else None
+      profile = cProfile.Profile()
+      try:
+        return profile.runcall(function)
+      finally:
+        after = tracemalloc.take_snapshot() if self.memory else None
+        self._stopTracing()
+        self._add(name, profile, before, after)
+    finally:
+      _profiling.release()
+
+  @staticmethod
+  def methodName(api):
+    """Returns name of the outermost method of api in the current call stack"""
+    frame, name = sys._getframe(1), None
+    while frame is not None:
+      if frame.f_locals.get('self') is api and not frame.f_code.co_name.startswith('_'):
+        name = frame.f_code.co_name
+      frame = frame.f_back
+    return '{0}.{1}'.format(type(api).__module__.split('.')[-1], name or 'call')
+
+  def _startTracing(self):
+    if not self.memory:
+      return
+    with self._lock:
+      if self._tracing == 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(self.frames)
+        self._tracing = 1
+      elif self._tracing:
+        self._tracing += 1
+
+  def _stopTracing(self):
+    if not self.memory:
+      return
+    with self._lock:
+      if self._tracing:
+        self._tracing -= 1
+        if self._tracing == 0:
+          tracemalloc.stop()
+
+  def _add(self, name, profile, before, after):
+    import pstats
+    with self._lock:
+      self._sampled[name] = self._sampled.get(name, 0) + 1
+      profile.create_stats()
+      if name in self._stats:
+        self._stats[name].add(profile)
+      else:
+        self._stats[name] = pstats.Stats(profile)
+      if before is not None and after is not None:
+        allocations = self._allocations.setdefault(name, {})
+        for diff in after.compare_to(before, 'lineno'):
+          if diff.size_diff > 0:
+            where = str(diff.traceback[0])
+            allocations[where] = allocations.get(where, 0) + diff.size_diff
+
+  def report(self, topN=20, sort='cumulative'):
+    """Returns text report with topN functions by sort key and topN allocating lines of each method"""
+    import pstats
+    try:
+      from StringIO import StringIO
+    except ImportError:
+      from io import StringIO
+    out = StringIO()
+    with self._lock:
+      for name in sorted(self._stats, key=lambda n: -self._stats[n].total_tt):
+        stats = self._stats[name]
+        out.write('{0}: {1} sampled calls, {2:.3f} s\n'.format(name, self._sampled[name], stats.total_tt))
+        pstats.Stats(stream=out).add(stats).sort_stats(sort).print_stats(topN)
+        allocations = self._allocations.get(name)
+        if allocations:
+          out.write('Allocated by {0} (KiB):\n'.format(name))
+          for where, size in sorted(allocations.items(), key=lambda item: -item[1])[:topN]:
+            out.write('  {0:10.1f}  {1}\n'.format(size / 1024.0, where))
+        out.write('\n')
+    return out.getvalue()
+
+  def dump(self, path, topN=20, sort='cumulative'):
+    """Writes report to file"""
+    with open(path, 'w') as f:
+      f.write(self.report(topN, sort))
+
+  def reset(self):
+    with self._lock:
+      self._stats, self._allocations, self._sampled = {}, {}, {}
+      self.calls = 0
+
+  def metrics(self):
+    with self._lock:
+      return {'calls': self.calls, 'sampled': dict(self._sampled)}
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Lightweight typed records for KBM results received in JSON format"""
+from collections import namedtuple
+
+Concept = namedtuple('Concept', ['id', 'kb'])
+WeightedConcept = namedtuple('WeightedConcept', ['id', 'kb', 'weight'])
+ConceptAttributes = namedtuple('ConceptAttributes', ['id', 'kb', 'attributes'])
+Edge = namedtuple('Edge', ['source', 'target', 'depth'])
+
+# Keys under which services put concept id, knowledge base name and weight
+ID_KEYS = ('id', '@id')
+KB_KEYS = ('kbname', 'kb-name', 'kbName', '@kbname')
+WEIGHT_KEYS = ('weight', 'similarity', 'value', 'double')
+SERVICE_KEYS = ID_KEYS + KB_KEYS + WEIGHT_KEYS + ('concept',)
+
+def _first(node, keys, default=None):
+  for key in keys:
+    if key in node:
+      return node[key]
+  return default
+
+def _items(payload):
+  """Unwraps single-key containers and 'id:kb' keyed maps into list of concept nodes,
+    maps of lists (e.g. neighbours grouped by source concept) are flattened into their nodes"""
+  while isinstance(payload, dict) and len(payload) == 1 and _first(payload, ID_KEYS) is None:
+    key, value = next(iter(payload.items()))
+    if ':' in str(key) and isinstance(value, dict):
+      break
+    payload = value
+  if isinstance(payload, list):
+    return payload
+  if isinstance(payload, dict):
+    if _first(payload, ID_KEYS) is not None:
+      return [payload]
+    items = []
+    for key, value in payload.items():
+      if isinstance(value, list):
+        items.extend(_items(value))
+        continue
+      ident, _, kb = str(key).partition(':')
+      node = dict(value) if isinstance(value, dict) else {'value': value}
+      node.setdefault('id', ident)
+      if kb: node.setdefault('kbname', kb)
+      items.append(node)
+    return items
+  return []
+
+def toConcept(node):
+  """Builds Concept record from service concept node"""
+  if isinstance(node.get('concept'), dict):
+    node = node['concept']
+  return Concept(int(_first(node, ID_KEYS)), _first(node, KB_KEYS))
+
+def concepts(payload):
+  """List of Concept records from JSON KBM response"""
+  return [toConcept(node) for node in _items(payload)]
+
+def weightedConcepts(payload):
+  """List of WeightedConcept records from JSON KBM response"""
+  result = []
+  for node in _items(payload):
+    concept = toConcept(node)
+    weight = _first(node, WEIGHT_KEYS)
+    result.append(WeightedConcept(concept.id, concept.kb, float(weight) if weight is not None else None))
+  return result
+
+def conceptAttributes(payload):
+  """List of ConceptAttributes records from JSON KBM response"""
+  result = []
+  for node in _items(payload):
+    concept = toConcept(node)
+    source = node.get('attributes', node)
+    attributes = dict((k, v) for k, v in source.items() if k not in SERVICE_KEYS)
+    result.append(ConceptAttributes(concept.id, concept.kb, attributes))
+  return result
+
+def neighbourGroups(payload, sources):
+  """List of (source Concept, list of neighbour Concepts) from JSON neighbours response.
+    Returns None if response does not tell which source the neighbours belong to"""
+  if isinstance(payload, dict) and payload and all(isinstance(v, list) and str(k).partition(':')[0].isdigit() for k, v in payload.items()):
+    groups = []
+    for key, value in payload.items():
+      ident, _, kb = str(key).partition(':')
+      groups.append((Concept(int(ident), kb or sources[0].kb), concepts(value)))
+    return groups
+  items = _items(payload)
+  if items and all(isinstance(node, dict) and isinstance(node.get('neighbours'), list) for node in items):
+    return [(toConcept(node), concepts(node['neighbours'])) for node in items]
+  if len(sources) == 1:
+    return [(sources[0], concepts(payload))]
+  return None
+
+def conceptsIn(value):
+  """Yields Concept records found anywhere in annotation value"""
+  if isinstance(value, dict):
+    ident, kb = _first(value, ID_KEYS), _first(value, KB_KEYS)
+    if ident is not None and kb is not None:
+      yield Concept(int(ident), kb)
+      return
+    value = list(value.values())
+  if isinstance(value, list):
+    for item in value:
+      for concept in conceptsIn(item):
+        yield concept
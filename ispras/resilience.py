@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Per-host circuit breaker for API clients"""
+import threading
+import time
+import requests
+try:
+  from urllib.parse import urlparse
+except ImportError:
+  from urlparse import urlparse
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+  """Raised without contacting the host while its circuit is open"""
+
+class _Circuit(object):
+  def __init__(self):
+    self.state = 'closed'
+    self.failures = 0
+    self.openedAt = 0.0
+    self.probing = False
+    self.trips = 0
+    self.rejected = 0
+
+class CircuitBreaker(object):
+  """Fails calls to a host fast after failureThreshold consecutive failures (connection errors,
+    timeouts, 5xx responses). After resetTimeout seconds one probe call is let through (half-open state):
+    its success closes the circuit, its failure opens it again.
+      t.breaker = CircuitBreaker(failureThreshold=5, resetTimeout=30)"""
+
+  def __init__(self, failureThreshold=5, resetTimeout=30.0):
+    self.failureThreshold = failureThreshold
+    self.resetTimeout = resetTimeout
+    self._lock = threading.Lock()
+    self._circuits = {}
+
+  def _circuit(self, url):
+    host = urlparse(url).netloc
+    circuit = self._circuits.get(host)
+    if circuit is None:
+      circuit = self._circuits[host] = _Circuit()
+    return host, circuit
+
+  def before(self, url):
+    """Raises CircuitOpenError if call to url host is not allowed now"""
+    with self._lock:
+      host, circuit = self._circuit(url)
+      if circuit.state == 'open' and time.time() - circuit.openedAt >= self.resetTimeout:
+        circuit.state = 'half-open'
+      if circuit.state == 'open' or (circuit.state == 'half-open' and circuit.probing):
+        circuit.rejected += 1
+        raise CircuitOpenError('Circuit for {0} is {1}'.format(host, circuit.state))
+      if circuit.state == 'half-open':
+        circuit.probing = True
+
+  def record(self, url, success):
+    """Records result of call allowed by before"""
+    with self._lock:
+      host, circuit = self._circuit(url)
+      circuit.probing = False
+      if success:
+        circuit.state = 'closed'
+        circuit.failures = 0
+      else:
+        circuit.failures += 1
+        if circuit.state == 'half-open' or circuit.failures >= self.failureThreshold:
+          if circuit.state != 'open':
+            circuit.trips += 1
+          circuit.state = 'open'
+          circuit.openedAt = time.time()
+
+  def metrics(self):
+    """Returns state, consecutive failures, number of trips and rejected calls per host"""
+    with self._lock:
+      return dict((host, {
+        'state': c.state,
+        'failures': c.failures,
+        'trips': c.trips,
+        'rejected': c.rejected
+      }) for host, c in self._circuits.items())
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Weighted fair queuing of API calls over shared concurrency budget"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class _Lane(object):
+  def __init__(self, name, weight):
+    self.name = name
+    self.weight = float(weight)
+    self.lastFinish = 0.0
+    self.queued = 0
+    self.active = 0
+    self.completed = 0
+    self.waits = deque(maxlen=1024)
+
+  def metrics(self):
+    waits = sorted(self.waits)
+    return {
+      'weight': self.weight,
+      'queued': self.queued,
+      'active': self.active,
+      'completed': self.completed,
+      'waitMean': sum(waits) / len(waits) if waits else 0.0,
+      'waitP99': waits[int(len(waits) * 0.99)] if waits else 0.0,
+      'waitMax': waits[-1] if waits else 0.0
+    }
+
+class LaneScheduler(object):
+  """Shares concurrency budget of a client between named priority lanes.
+    Calls are started in order of weighted fair queuing: a lane with weight 10 gets
+    ten times more slots than a lane with weight 1 while both have queued calls.
+    Set it as client scheduler and select lane for a block of calls:
+      t.scheduler = LaneScheduler({'interactive': 10, 'bulk': 1}, concurrency=8)
+      with t.scheduler.lane('bulk'):
+        t.tokenizationAnnotate(text)"""
+
+  def __init__(self, lanes, concurrency=8, default=None):
+    if not lanes:
+      raise ValueError('At least one lane is required')
+    self.lanes = dict((name, _Lane(name, weight)) for name, weight in lanes.items())
+    self.concurrency = concurrency
+    self.default = default if default is not None else max(lanes, key=lambda name: lanes[name])
+    self._cond = threading.Condition()
+    self._queue = []
+    self._counter = itertools.count()
+    self._virtualTime = 0.0
+    self._active = 0
+    self._local = threading.local()
+
+  @contextmanager
+  def lane(self, name):
+    """Routes calls made by current thread inside the block to lane name"""
+    if name not in self.lanes:
+      raise KeyError('Unknown lane {0}'.format(name))
+    previous = getattr(self._local, 'lane', None)
+    self._local.lane = name
+    try:
+      yield
+    finally:
+      self._local.lane = previous
+
+  def bind(self, function):
+    """Returns function making its calls in lane of current thread, to be run by worker threads"""
+    name = self.current()
+    def bound(*args, **kwargs):
+      with self.lane(name):
+        return function(*args, **kwargs)
+    return bound
+
+  def current(self):
+    """Returns lane name of current thread"""
+    return getattr(self._local, 'lane', None) or self.default
+
+  @contextmanager
+  def slot(self, lane=None, deadline=None):
+    """Waits for the turn of lane (current thread lane by default) and holds one slot of concurrency budget.
+      Raises requests.exceptions.Timeout if the turn does not come before deadline (time.time() value)"""
+    lane = self.lanes[lane or self.current()]
+    queued = time.time()
+    with self._cond:
+      tag = max(self._virtualTime, lane.lastFinish) + 1.0 / lane.weight
+      lane.lastFinish = tag
+      entry = (tag, next(self._counter))
+      heapq.heappush(self._queue, entry)
+      lane.queued += 1
+      while self._active >= self.concurrency or self._queue[0] is not entry:
+        left = deadline - time.time() if deadline is not None else None
+        if left is not None and left <= 0:
+          self._queue.remove(entry)
+          heapq.heapify(self._queue)
+          lane.queued -= 1
+          self._cond.notify_all()
+          import requests
+          raise requests.exceptions.Timeout('Deadline exceeded waiting for {0} lane'.format(lane.name))
+        self._cond.wait(left)
+      heapq.heappop(self._queue)
+      self._virtualTime = tag
+      self._active += 1
+      lane.queued -= 1
+      lane.active += 1
+      lane.waits.append(time.time() - queued)
+      # Next queued call may also fit into the budget
+      self._cond.notify_all()
+    try:
+      yield
+    finally:
+      with self._cond:
+        self._active -= 1
+        lane.active -= 1
+        lane.completed += 1
+        self._cond.notify_all()
+
+  def metrics(self):
+    """Returns queue depth, active calls and wait time statistics (seconds) per lane"""
+    with self._cond:
+      return dict((name, lane.metrics()) for name, lane in self.lanes.items())
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Local aggregation of concept similarities"""
+import threading
+from .records import WeightedConcept
+
+class SimilarityEngine(object):
+  """Keeps pairwise similarities returned by similarityGraph for one knowledge base and link weight,
+    and answers summed similarity queries locally when every needed pair is known.
+    Missing pairs are learned with one similarityGraph request over concepts they touch,
+    unless there are more than maxFetchConcepts of them: then the query is sent to the service.
+    Virtual article similarities can not be derived from pairs and are always sent to the service."""
+
+  def __init__(self, api, kbname, linkWeight='MAX', maxFetchConcepts=50):
+    self.api = api
+    self.kbname = kbname
+    self.linkWeight = linkWeight
+    self.maxFetchConcepts = maxFetchConcepts
+    self._rows = {}
+    self._lock = threading.Lock()
+    self.local = 0
+    self.remote = 0
+    self.graphs = 0
+
+  def learn(self, matrix):
+    """Stores similarity matrix {concept: {concept: similarity}}"""
+    with self._lock:
+      for a, row in matrix.items():
+        if not isinstance(row, dict):
+          continue
+        self._rows.setdefault(a, {a: 1.0}).update(row)
+        for b, value in row.items():
+          self._rows.setdefault(b, {b: 1.0})[a] = value
+
+  def similarityGraph(self, concepts):
+    """Same as API.similarityGraph, learns the result"""
+    self.graphs += 1
+    matrix = self.api.similarityGraph(concepts, self.kbname, self.linkWeight, format='json')
+    self.learn(matrix)
+    return matrix
+
+  def similarity(self, first, second):
+    """Returns known similarity of two concepts or None"""
+    if first == second:
+      return 1.0
+    return self._rows.get(first, {}).get(second)
+
+  def missing(self, first, second):
+    """Returns set of concepts of first and second lists which take part in unknown pairs"""
+    touched = set()
+    for a in set(first):
+      row = self._rows.get(a, {})
+      for b in set(second):
+        if a != b and b not in row:
+          touched.add(a)
+          touched.add(b)
+    return touched
+
+  def allPairsSimilarity(self, firstConcepts, secondConcepts):
+    """Same as API.allPairsSimilarity with format='json': list of records.WeightedConcept
+      with sum of similarities from each concept of the first list to all concepts of the second one"""
+    first = firstConcepts if isinstance(firstConcepts, list) else [firstConcepts]
+    second = secondConcepts if isinstance(secondConcepts, list) else [secondConcepts]
+    touched = self.missing(first, second)
+    if len(touched) > self.maxFetchConcepts:
+      self.remote += 1
+      return self.api.allPairsSimilarity(first, second, self.kbname, self.linkWeight, format='json')
+    if len(touched) > 1:
+      self.similarityGraph(sorted(touched))
+    self.local += 1
+    with self._lock:
+      return [WeightedConcept(a, self.kbname, float(sum(map(self._row(a).__getitem__, second)))) for a in first]
+
+  def _row(self, a):
+    row = self._rows.setdefault(a, {})
+    row.setdefault(a, 1.0)
+    return row
+
+  def similarityToVirtualArticle(self, concepts, virtualArticle):
+    self.remote += 1
+    return self.api.similarityToVirtualArticle(concepts, virtualArticle, self.kbname, self.linkWeight, format='json')
+
+  def similarityBetweenVirtualArticles(self, firstVirtualArticle, secondVirtualArticle):
+    self.remote += 1
+    return self.api.similarityBetweenVirtualArticles(firstVirtualArticle, secondVirtualArticle, self.kbname, self.linkWeight, format='json')
+
+  def metrics(self):
+    return {'concepts': len(self._rows), 'local': self.local, 'remote': self.remote, 'graphs': self.graphs}
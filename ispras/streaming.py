@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Incremental parsing of Texterra JSON documents"""
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+class _Reader(object):
+  """Buffer over stream of chunks which drops consumed text"""
+
+  def __init__(self, chunks):
+    self.chunks = iter(chunks)
+    self.decode = codecs.getincrementaldecoder('utf-8')().decode
+    self.buf = ''
+    self.pos = 0
+    self.parts = []
+    self.partsSize = 0
+    self.eof = False
+
+  def more(self):
+    """Reads next chunk into pending parts"""
+    if self.eof:
+      return False
+    try:
+      chunk = next(self.chunks)
+    except StopIteration:
+      self.eof = True
+      chunk = self.decode(b'', True)
+    else:
+      if isinstance(chunk, bytes):
+        chunk = self.decode(chunk)
+    self.parts.append(chunk)
+    self.partsSize += len(chunk)
+    return True
+
+  def merge(self):
+    """Moves pending parts to buffer"""
+    if self.parts:
+      self.buf = self.buf[self.pos:] + ''.join(self.parts)
+      self.pos = 0
+      self.parts = []
+      self.partsSize = 0
+
+  def available(self):
+    return len(self.buf) - self.pos + self.partsSize
+
+  def peek(self):
+    """Skips whitespace and returns next char"""
+    while True:
+      while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+        self.pos += 1
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if self.parts:
+        self.merge()
+      elif not self.more():
+        raise ValueError('Unexpected end of JSON document')
+
+  def expect(self, chars):
+    char = self.peek()
+    if char not in chars:
+      raise ValueError('Unexpected {0!r} in JSON document, expected one of {1!r}'.format(char, chars))
+    self.pos += 1
+    return char
+
+  def value(self):
+    """Decodes next complete JSON value"""
+    self.peek()
+    need = 0
+    while True:
+      if self.available() >= need or self.eof:
+        self.merge()
+        try:
+          obj, end = _decoder.raw_decode(self.buf, self.pos)
+          # Number at the end of buffer may continue in the next chunk
+          if end < len(self.buf) or self.eof:
+            self.pos = end
+            return obj
+        except ValueError:
+          if self.eof:
+            raise
+        # Wait until buffered part doubles, so large values are not re-decoded on every chunk
+        need = 2 * self.available()
+      self.more()
+
+def iterAnnotations(chunks):
+  """Yields (class, annotation) pairs of Texterra document as soon as each annotation is received.
+    chunks is iterable of bytes or text parts of JSON document"""
+  reader = _Reader(chunks)
+  reader.expect('{')
+  if reader.peek() == '}':
+    return
+  while True:
+    key = reader.value()
+    reader.expect(':')
+    if key == 'annotations':
+      reader.expect('{')
+      if reader.peek() == '}':
+        reader.pos += 1
+      else:
+        while True:
+          annotationClass = reader.value()
+          reader.expect(':')
+          reader.expect('[')
+          if reader.peek() == ']':
+            reader.pos += 1
+          else:
+            while True:
+              yield annotationClass, reader.value()
+              if reader.expect(',]') == ']':
+                break
+          if reader.expect(',}') == '}':
+            break
+    else:
+      reader.value()
+    if reader.expect(',}') == '}':
+      return
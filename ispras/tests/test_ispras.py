@@ -5,14 +5,385 @@ from ispras import twitter
 from ispras import texterra
 
 import os
+import sys
+import itertools
+import time
+import json
 from os.path import join, dirname, abspath
 from dotenv import load_dotenv
 
 dotenv_path = join(dirname(__file__), '..', '..', '.env')
 load_dotenv(dotenv_path)
 
+# Import Tests
+
+class ImportTest(unittest.TestCase):
+  def test_lazy_dependencies(self):
+    import sys
+    import subprocess
+    # Modules loaded by interpreter startup (e.g. site hooks) are not counted
+    probe = 'import sys; before = set(sys.modules); import ispras.texterra, ispras.twitter; print(",".join(m for m in ("requests", "xmltodict", "json", "difflib", "tempfile") if m in sys.modules and m not in before))'
+    out = subprocess.check_output([sys.executable, '-c', probe], cwd=join(dirname(abspath(__file__)), '..', '..'))
+    self.assertEqual(out.decode('utf-8').strip(), '')
+
+class UploadTest(unittest.TestCase):
+  def test_encode(self):
+    from ispras import uploads
+    try:
+      from urllib import urlencode
+    except ImportError:
+      from urllib.parse import urlencode
+    text = u'Переговоры министра, 1,5 часа & more'
+    kwargs, sent, form = uploads.encode('raw', {'text': text})
+    self.assertEqual(kwargs['data'], text.encode('utf-8'))
+    self.assertEqual(form, len(urlencode({'text': text.encode('utf-8')})))
+    self.assertLess(sent, form)
+    kwargs, sent, form = uploads.encode('raw', {'lang': 'ru', 'tweet': text})
+    self.assertTrue(kwargs['headers']['Content-Type'].startswith('multipart/form-data'))
+    self.assertEqual(uploads.encode('multipart', {'tweet': text})[0], uploads.encode('multipart', {'tweet': text})[0])
+
+class DedupTest(unittest.TestCase):
+  def test_collapse(self):
+    from ispras import dedup
+    tweet = 'Apple today updated iMac to bring numerous high-performance enhancements to the desktop'
+    texts = [tweet, 'RT @someone: ' + tweet, tweet, 'Completely different text about weather in Moscow']
+    self.assertEqual(dedup.collapse(texts, threshold=0.6), [0, 0, 0, 3])
+    self.assertEqual(dedup.collapse(texts, keys=['en', 'ru', 'en', 'en'], threshold=0.6), [0, 1, 0, 3])
+
+  def test_nearDuplicates(self):
+    from ispras import dedup
+    calls = []
+    def method(text):
+      calls.append(text)
+      start = text.index('iMac')
+      return {'text': text, 'annotations': {'named-entity': [{'start': start, 'end': start + 4, 'value': 'PRODUCT'}]}}
+    tweet = 'Apple today updated iMac to bring numerous high-performance enhancements to the desktop'
+    documents = dedup.NearDuplicates(method, threshold=0.6).annotate([tweet, 'RT @someone: ' + tweet])
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(documents[1]['annotations']['named-entity'][0]['text'], 'iMac')
+
+class RecordsTest(unittest.TestCase):
+  def test_groupedConcepts(self):
+    from ispras import records, transport
+    payload = {'12:enwiki': [{'id': 13, 'kbname': 'enwiki'}], '713:enwiki': [{'id': 14, 'kbname': 'enwiki'}, {'id': 15, 'kbname': 'enwiki'}]}
+    self.assertEqual(sorted(c.id for c in records.concepts(payload)), [13, 14, 15])
+    self.assertEqual(records.concepts({'12:enwiki': [{'id': 13, 'kbname': 'enwiki'}]}), [records.Concept(13, 'enwiki')])
+    t = texterra.API(host='http://texterra.local/', key=False)
+    t.transport = transport.LocalTransport(lambda request: (200, json.dumps(payload)))
+    self.assertEqual(sorted(c.id for c in t.neighbours([12, 713], 'enwiki', format='json')), [13, 14, 15])
+
+class PagingTest(unittest.TestCase):
+  def test_cappedPages(self):
+    from ispras import paging
+    limits = []
+    def fetch(offset, limit):
+      limits.append(limit)
+      return list(range(1000))[offset:offset + min(limit, 100)]
+    self.assertEqual(list(paging.iterPages(fetch)), list(range(1000)))
+    self.assertEqual(max(limits), 200)
+    self.assertEqual(list(paging.iterPages(lambda offset, limit: list(range(120))[offset:offset + limit])), list(range(120)))
+
+class TransportTest(unittest.TestCase):
+  def setUp(self):
+    from ispras import transport
+    def handler(request):
+      if 'nlp/' in request.url:
+        return 200, '{"annotations": {"token": [{"start": 0, "end": 5, "value": ""}]}}'
+      return 200, '<concept-attributes><title>Anarchism</title></concept-attributes>'
+    self.transport = transport.LocalTransport(handler)
+    self.texterra = texterra.API(host='http://texterra.local/', key=False)
+    self.texterra.transport = self.transport
+
+  def test_localTransport(self):
+    self.assertEqual(self.texterra.tokenizationAnnotate('Hello world')['annotations']['token'][0]['text'], 'Hello')
+    self.assertEqual(self.texterra.getAttributes(12, 'enwiki')['concept-attributes']['title'], 'Anarchism')
+    self.assertEqual(self.transport.calls, 2)
+
+  def test_byteBudget(self):
+    from ispras import flowcontrol
+    self.texterra.budget = flowcontrol.ByteBudget(maxBytes=1024)
+    self.texterra.tokenizationAnnotate('Hello world')
+    budget = self.texterra.metrics()['budget']
+    self.assertEqual(budget['inFlight'], 0)
+    self.assertGreater(budget['peak'], 0)
+
+  def test_streamedBudget(self):
+    import threading
+    from ispras import flowcontrol
+    self.texterra.budget = flowcontrol.ByteBudget(maxBytes=3000)
+    results = []
+    def consume():
+      for annotationClass, an in self.texterra.iterAnnotations('tokenization', 'Hello' + ' world' * 100):
+        # Bigger call queues behind the stream, the next one queues behind it
+        waiting = threading.Thread(target=lambda: results.append(self.texterra.tokenizationAnnotate('Hello' * 200)))
+        waiting.start()
+        results.append(self.texterra.getAttributes(12, 'enwiki'))
+        waiting.join()
+    consumer = threading.Thread(target=consume)
+    consumer.daemon = True
+    consumer.start()
+    consumer.join(5)
+    self.assertFalse(consumer.is_alive())
+    self.assertEqual(len(results), 2)
+    self.assertEqual(self.texterra.metrics()['budget']['inFlight'], 0)
+
+  def test_cachedUploads(self):
+    import tempfile
+    from ispras import cache
+    self.texterra.cache = cache.DiskCache(join(tempfile.mkdtemp(), 'cache.sqlite'))
+    self.texterra.tokenizationAnnotate('Hello world')
+    sent = self.texterra.metrics()['uploads']['tokenization']
+    self.texterra.tokenizationAnnotate('Hello world')
+    self.assertEqual(self.texterra.metrics()['uploads']['tokenization'], sent)
+    self.assertEqual(self.transport.calls, 1)
+
+  def test_workerLanes(self):
+    from ispras import transport, scheduler
+    self.texterra.transport = transport.LocalTransport(lambda request: (200, '[]'))
+    self.texterra.scheduler = scheduler.LaneScheduler({'interactive': 10, 'bulk': 1})
+    with self.texterra.scheduler.lane('bulk'):
+      list(self.texterra.traverseNeighbours([12, 13], 'enwiki', maxDepth=1, chunkSize=1))
+      list(self.texterra.iterSimilarOverFirstNeighbours(12, 'enwiki'))
+    lanes = self.texterra.metrics()['lanes']
+    self.assertEqual((lanes['bulk']['completed'], lanes['interactive']['completed']), (3, 0))
+
+  def test_laneOrder(self):
+    import re
+    import threading
+    from ispras import transport, scheduler
+    dispatched, release = [], threading.Event()
+    def handler(request):
+      ident = int(re.search(r'id=(\d+):', request.url).group(1))
+      dispatched.append(ident)
+      if ident == 0:
+        release.wait(5)
+      return 200, '[]'
+    self.texterra.transport = transport.LocalTransport(handler)
+    self.texterra.scheduler = scheduler.LaneScheduler({'interactive': 10, 'bulk': 1}, concurrency=1)
+    def call(ident, lane):
+      with self.texterra.scheduler.lane(lane):
+        self.texterra.getAttributes(ident, 'enwiki', format='json')
+    def waiting():
+      return sum(lane['queued'] + lane['active'] for lane in self.texterra.metrics()['lanes'].values())
+    threads = []
+    # First bulk call holds the only slot, bulk backlog queues up behind it before the interactive call
+    for ident, lane in [(0, 'bulk'), (1, 'bulk'), (2, 'bulk'), (3, 'bulk'), (100, 'interactive')]:
+      threads.append(threading.Thread(target=call, args=(ident, lane)))
+      threads[-1].start()
+      while waiting() < len(threads):
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(dispatched, [0, 100, 1, 2, 3])
+
+  def test_concurrentProfiling(self):
+    from multiprocessing.pool import ThreadPool
+    from ispras import transport, profiling
+    self.texterra.transport = transport.LocalTransport(lambda request: (200, '[]'), latency=0.01)
+    self.texterra.profiler = profiling.Profiler(sampleRate=1.0)
+    pool = ThreadPool(4)
+    results = pool.map(lambda i: self.texterra.getAttributes(12, 'enwiki', format='json'), range(8))
+    pool.close()
+    self.assertEqual(results, [[]] * 8)
+    self.assertGreater(self.texterra.metrics()['profiling']['sampled']['texterra.getAttributes'], 0)
+
+  def test_batchesInFlight(self):
+    import threading
+    from multiprocessing.pool import ThreadPool
+    from ispras import transport
+    lock, active, peak = threading.Lock(), [0], [0]
+    def handler(request):
+      with lock:
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+      time.sleep(0.1)
+      with lock:
+        active[0] -= 1
+      return 200, '{"annotations": {"token": [{"start": 0, "end": 5, "value": ""}]}}'
+    self.texterra.transport = transport.LocalTransport(handler)
+    # Every text fills a batch, so batches can only overlap in flight
+    batcher = self.texterra.nlpBatcher('tokenization', maxBytes=10, maxInFlight=3)
+    pool = ThreadPool(6)
+    results = pool.map(batcher.annotate, ['Hello world'] * 6)
+    pool.close()
+    batcher.close()
+    self.assertEqual([r['annotations']['token'][0]['text'] for r in results], ['Hello'] * 6)
+    self.assertEqual(peak[0], 3)
+
+  def test_spawnedParsing(self):
+    from ispras import offload
+    expected = self.texterra.tokenizationAnnotate('Hello world'), self.texterra.getAttributes(12, 'enwiki')
+    self.texterra.parsePool = offload.ParsePool(1, minBytes=0)
+    try:
+      self.assertEqual((self.texterra.tokenizationAnnotate('Hello world'), self.texterra.getAttributes(12, 'enwiki')), expected)
+      self.assertEqual(self.texterra.metrics()['parsing']['offloaded'], 2)
+    finally:
+      self.texterra.parsePool.close()
+
+  def test_hedgedStragglers(self):
+    import threading
+    from ispras import transport, hedging
+    lock, counter, closed = threading.Lock(), [0], []
+    def handler(request):
+      with lock:
+        number = counter[0]
+        counter[0] += 1
+      if number >= 10 and number % 4 == 0:
+        time.sleep(0.2)
+        return transport.Response(200, b'[]', url=request.url, close=lambda: closed.append(number))
+      return 200, '[]'
+    self.texterra.transport = transport.LocalTransport(handler)
+    self.texterra.hedger = hedging.Hedger(percentile=50, budget=0.1, minSamples=5, minDelay=0.02)
+    for _ in range(40):
+      self.assertEqual(self.texterra.getAttributes(12, 'enwiki', format='json'), [])
+    hedged = self.texterra.metrics()['hedging']
+    self.assertGreater(hedged['hedges'], 0)
+    self.assertLessEqual(hedged['hedges'], 0.1 * hedged['calls'])
+    self.assertEqual(hedged['wins'], hedged['hedges'])
+    # Slow responses that lost the race are closed once they arrive
+    for _ in range(50):
+      if len(closed) == hedged['wins']:
+        break
+      time.sleep(0.01)
+    self.assertEqual(len(closed), hedged['wins'])
+
+  def test_queuedDeadline(self):
+    import threading
+    from ispras import transport, scheduler, flowcontrol
+    self.texterra.transport = transport.LocalTransport(lambda request: (200, '[]'), latency=1.0)
+    self.texterra.scheduler = scheduler.LaneScheduler({'interactive': 1}, concurrency=1)
+    busy = threading.Thread(target=lambda: self.texterra.getAttributes(12, 'enwiki', format='json'))
+    busy.start()
+    time.sleep(0.1)
+    started = time.time()
+    with self.assertRaises(requests.exceptions.Timeout):
+      with self.texterra.deadline(0.2):
+        self.texterra.getAttributes(13, 'enwiki', format='json')
+    self.assertLess(time.time() - started, 0.5)
+    busy.join()
+    self.assertEqual(self.texterra.metrics()['lanes']['interactive']['queued'], 0)
+    self.texterra.scheduler = None
+    self.texterra.budget = flowcontrol.ByteBudget(maxBytes=10)
+    with self.texterra.budget.hold(10):
+      with self.assertRaises(requests.exceptions.Timeout):
+        with self.texterra.deadline(0.2):
+          self.texterra.tokenizationAnnotate('Hello world')
+    self.assertEqual(self.texterra.metrics()['budget']['waiting'], 0)
+
+  def test_replicaCircuits(self):
+    from ispras import transport, resilience
+    def handler(request):
+      if request.url.startswith('http://a.local/'):
+        raise requests.exceptions.ConnectionError('a is down')
+      return 200, '[]'
+    t = texterra.API(host='http://a.local/,http://b.local/', key=False)
+    t.transport = transport.LocalTransport(handler)
+    t.balancer.healthInterval = 0
+    t.balancer.ejectAfter = 100
+    t.breaker = resilience.CircuitBreaker(failureThreshold=2, resetTimeout=60)
+    t.retries = 1
+    t.retryBackoff = 0
+    for _ in range(20):
+      self.assertEqual(t.getAttributes(12, 'enwiki', format='json'), [])
+    breaker = t.metrics()['breaker']
+    self.assertEqual((breaker['a.local']['state'], breaker['b.local']['state']), ('open', 'closed'))
+    self.assertEqual(t.metrics()['hosts']['http://a.local/']['requests'], 2)
+
+  def test_errors(self):
+    from ispras import transport
+    self.texterra.transport = transport.LocalTransport(lambda request: (503, 'unavailable'))
+    self.texterra.retries = 1
+    self.texterra.retryBackoff = 0
+    with self.assertRaises(requests.exceptions.HTTPError):
+      self.texterra.getAttributes(12, 'enwiki')
+    self.assertEqual(self.texterra.transport.calls, 2)
+
+class GraphStoreTest(unittest.TestCase):
+  def test_saveLoaded(self):
+    import tempfile
+    from ispras import graphstore
+    store = graphstore.GraphStore('enwiki')
+    store.addNeighbours(12, [13, 14])
+    path = join(tempfile.mkdtemp(), 'enwiki.graph')
+    store.save(path)
+    loaded = graphstore.GraphStore.load(path)
+    loaded.save(path)
+    self.assertEqual(graphstore.GraphStore.load(path).neighbours(12), [13, 14])
+    self.assertEqual(loaded.neighbours(12), [13, 14])
+
+  def test_khop(self):
+    from ispras import graphstore, records
+    calls = []
+    def fetch(concepts):
+      calls.append([c.id for c in concepts])
+      return [(c, [records.Concept(c.id * 10 + j, 'enwiki') for j in (1, 2)]) for c in concepts]
+    store = graphstore.GraphStore('enwiki', fetch)
+    self.assertEqual(len(store.khop(1, 2)), 7)
+    self.assertEqual(calls, [[1], [11, 12]])
+    chunked = graphstore.GraphStore('enwiki', fetch, chunkSize=3)
+    del calls[:]
+    self.assertEqual(len(chunked.khop(1, 3)), 15)
+    self.assertEqual([len(chunk) for chunk in calls], [1, 2, 3, 1])
+    offline = graphstore.GraphStore('enwiki')
+    offline.addNeighbours(1, [2, 3])
+    self.assertEqual(offline.khop(1, 3), {1: 0, 2: 1, 3: 1})
+
 # Texterra Tests
 
+class ResilienceTest(unittest.TestCase):
+  def setUp(self):
+    # Nothing listens on discard port, so every call fails to connect
+    self.texterra = texterra.API(host='http://127.0.0.1:9/', key=False)
+
+  def test_circuitBreaker(self):
+    from ispras import resilience
+    self.texterra.breaker = resilience.CircuitBreaker(failureThreshold=2, resetTimeout=60)
+    for _ in range(2):
+      with self.assertRaises(requests.exceptions.ConnectionError):
+        self.texterra.getAttributes(12, 'enwiki')
+    with self.assertRaises(resilience.CircuitOpenError):
+      self.texterra.getAttributes(12, 'enwiki')
+    self.assertEqual(self.texterra.metrics()['breaker']['127.0.0.1:9']['state'], 'open')
+
+  def test_deadline(self):
+    self.texterra.retries = 100
+    with self.assertRaises(requests.exceptions.RequestException):
+      with self.texterra.deadline(0.5):
+        self.texterra.getAttributes(12, 'enwiki')
+
+  def test_profiler(self):
+    from ispras import profiling
+    self.texterra.profiler = profiling.Profiler(sampleRate=1.0)
+    with self.assertRaises(requests.exceptions.ConnectionError):
+      self.texterra.getAttributes(12, 'enwiki')
+    self.assertEqual(self.texterra.metrics()['profiling']['sampled'], {'texterra.getAttributes': 1})
+    self.assertIn('texterra.getAttributes', self.texterra.profiler.report(topN=5))
+
+
+  def test_hostPool(self):
+    from ispras import balancing
+    pool = balancing.HostPool(['http://127.0.0.1:9/', 'http://127.0.0.1:10/'], ejectAfter=2, healthInterval=0)
+    first = pool.acquire()
+    second = pool.acquire()
+    self.assertNotEqual(first.url, second.url)
+    for host in (first, second):
+      pool.release(host, 0.01, True)
+    for _ in range(2):
+      pool.release(pool.acquire(avoid=[second]), 0.01, False)
+    self.assertTrue(pool.metrics()[first.url]['ejected'])
+    self.assertEqual(pool.acquire(), second)
+
+  def test_multipleHosts(self):
+    t = texterra.API(host='http://127.0.0.1:9/,http://127.0.0.1:10/', key=False)
+    for _ in range(2):
+      with self.assertRaises(requests.exceptions.ConnectionError):
+        t.getAttributes(12, 'enwiki')
+    hosts = t.metrics()['hosts']
+    self.assertEqual(sorted(hosts), ['http://127.0.0.1:10/', 'http://127.0.0.1:9/'])
+    self.assertEqual(sum(h['failures'] for h in hosts.values()), 2)
+
+
 class CustomTexterraAPITest(unittest.TestCase):
   def setUp(self):
     TEXTERRA_CUSTOM_HOST = os.getenv("TEXTERRA_CUSTOM_HOST")
@@ -160,12 +531,138 @@ class TexterraAPITest(unittest.TestCase):
     self.assertIsInstance(self.texterra.similarOverFilteredNeighbours(12, 'enwiki'), dict)
     self.assertIsInstance(self.texterra.similarOverFilteredNeighbours(12, 'enwiki', linkWeight='MIN', offset=1, limit=3, among='PORTION(0.2)'), dict)
 
+  def test_iterSimilarOverNeighbours(self):
+    first = self.texterra.similarOverFirstNeighbours(12, 'enwiki', limit=30, format='json')
+    self.assertEqual(list(itertools.islice(self.texterra.iterSimilarOverFirstNeighbours(12, 'enwiki', pageSize=10), 30)), first)
+    filtered = self.texterra.iterSimilarOverFilteredNeighbours(12, 'enwiki', among='PORTION(0.2)', pageSize=10)
+    self.assertEqual(len(list(itertools.islice(filtered, 15))), 15)
+    filtered.close()
+
   def test_getAttributes(self):
     self.assertIsInstance(self.texterra.getAttributes(12, 'enwiki'), dict)
     self.assertIsInstance(self.texterra.getAttributes([12, 13137], 'enwiki'), dict)
     self.assertIsInstance(self.texterra.getAttributes(12, 'enwiki', ['url(en)', 'type']), dict)
     self.assertIsInstance(self.texterra.getAttributes([12, 13137], 'enwiki', ['url(en)', 'title']), dict)
 
+  def test_json_kbm(self):
+    from ispras import records
+    self.assertIsInstance(self.texterra.neighbours(12, 'enwiki', format='json')[0], records.Concept)
+    self.assertIsInstance(self.texterra.getAttributes([12, 13137], 'enwiki', ['title'], format='json')[0], records.ConceptAttributes)
+    self.assertIsInstance(self.texterra.similarOverFirstNeighbours(12, 'enwiki', limit=3, format='json')[0], records.WeightedConcept)
+    self.assertEqual(self.texterra.similarityGraph([12, 13137, 156327], 'enwiki', format='json'), self.texterra.similarityGraph([12, 13137, 156327], 'enwiki'))
+
+  def test_nlpBatcher(self):
+    batcher = self.texterra.nlpBatcher('tokenization')
+    texts = [self.en_tweet, self.ru_tweet]
+    results = [None, None]
+    def annotate(i):
+      results[i] = batcher.annotate(texts[i])
+    import threading
+    threads = [threading.Thread(target=annotate, args=(i,)) for i in range(len(texts))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    batcher.close()
+    for text, result in zip(texts, results):
+      self.assertEqual(result['annotations']['token'], self.texterra.tokenizationAnnotate(text)['annotations']['token'])
+    with self.assertRaises(ValueError):
+      self.texterra.nlpBatcher('disambiguation')
+
+  def test_scheduler_lanes(self):
+    from ispras import scheduler
+    self.texterra.scheduler = scheduler.LaneScheduler({'interactive': 10, 'bulk': 1}, concurrency=2)
+    with self.texterra.scheduler.lane('bulk'):
+      self.assertIsInstance(self.texterra.tokenizationAnnotate(self.en_tweet), dict)
+    self.assertIsInstance(self.texterra.sentimentAnalysis(self.en_tweet), str if sys.version_info[0] == 3 else basestring)
+    lanes = self.texterra.metrics()['lanes']
+    self.assertEqual(lanes['bulk']['completed'], 1)
+    self.assertEqual(lanes['interactive']['completed'], 1)
+    self.assertEqual(lanes['interactive']['queued'], 0)
+
+  def test_iterAnnotations(self):
+    streamed = [an for cls, an in self.texterra.iterAnnotations('posTagging', self.ru_text)]
+    self.assertEqual(streamed, self.texterra.posTaggingAnnotate(self.ru_text)['annotations']['pos-token'])
+
+  def test_traverseNeighbours(self):
+    from ispras import records
+    edges = list(self.texterra.traverseNeighbours([12, 713], 'enwiki', maxDepth=2, fanout=3, maxEdges=20))
+    self.assertTrue(0 < len(edges) <= 20)
+    self.assertIsInstance(edges[0], records.Edge)
+    self.assertEqual(edges[0].depth, 1)
+
+  def test_diskCache(self):
+    import tempfile
+    from ispras import cache
+    self.texterra.cache = cache.DiskCache(join(tempfile.mkdtemp(), 'cache.sqlite'))
+    first = self.texterra.getAttributes(12, 'enwiki')
+    self.assertEqual(self.texterra.getAttributes(12, 'enwiki'), first)
+    self.assertEqual(self.texterra.tokenizationAnnotate(self.en_tweet), self.texterra.tokenizationAnnotate(self.en_tweet))
+    self.assertEqual(self.texterra.metrics()['cache']['hits'], 2)
+
+  def test_hedging(self):
+    from ispras import hedging
+    self.texterra.hedger = hedging.Hedger(minSamples=2, budget=1.0)
+    for _ in range(4):
+      self.assertIsInstance(self.texterra.getAttributes(12, 'enwiki'), dict)
+    self.assertEqual(self.texterra.metrics()['hedging']['calls'], 4)
+
+  def test_parsePool(self):
+    from ispras import offload
+    expected = self.texterra.posTaggingAnnotate(self.en_text), self.texterra.similarityGraph([12, 13137, 156327], 'enwiki')
+    self.texterra.parsePool = offload.ParsePool(2, minBytes=0)
+    try:
+      self.assertEqual((self.texterra.posTaggingAnnotate(self.en_text), self.texterra.similarityGraph([12, 13137, 156327], 'enwiki')), expected)
+      self.assertEqual(self.texterra.metrics()['parsing']['offloaded'], 2)
+    finally:
+      self.texterra.parsePool.close()
+
+  def test_incrementalAnnotator(self):
+    annotator = self.texterra.incrementalAnnotator('posTagging')
+    first = self.en_text + '\n\n' + self.en_tweet
+    edited = self.en_text + '\n\n' + self.ru_tweet
+    annotator.annotate('doc', first)
+    self.assertEqual(annotator.annotate('doc', edited), self.texterra.posTaggingAnnotate(edited))
+    self.assertEqual(annotator.metrics()['requests'], 2)
+    with self.assertRaises(ValueError):
+      self.texterra.incrementalAnnotator('polarityDetection')
+    with self.assertRaises(ValueError):
+      self.texterra.incrementalAnnotator('namedEntities', granularity='sentence')
+    with self.assertRaises(ValueError):
+      self.texterra.incrementalAnnotator('disambiguation')
+
+  def test_graphStore(self):
+    import tempfile
+    store = self.texterra.graphStore('enwiki')
+    store.addEdges(self.texterra.traverseNeighbours(12, 'enwiki', maxDepth=1))
+    store.addAttributes(self.texterra.getAttributes(12, 'enwiki', ['title'], format='json'))
+    path = join(tempfile.mkdtemp(), 'enwiki.graph')
+    store.save(path)
+    loaded = self.texterra.graphStore('enwiki', path)
+    self.assertEqual(loaded.neighbours(12), store.neighbours(12))
+    self.assertEqual(loaded.attributes(12), store.attributes(12))
+    self.assertEqual(loaded.fetched, 0)
+    self.assertGreater(len(loaded.khop(12, 2)), loaded.degree(12))
+
+  def test_attributePrefetcher(self):
+    from ispras import prefetch, records
+    self.texterra.prefetcher = prefetch.AttributePrefetcher(self.texterra, ['title'])
+    concepts = list(records.conceptsIn([an['value'] for an in self.texterra.disambiguation(self.en_text)]))
+    self.assertTrue(concepts)
+    attributes = self.texterra.getAttributes([c.id for c in concepts], concepts[0].kb, ['title'], format='json')
+    self.assertIsInstance(attributes[0], records.ConceptAttributes)
+    self.assertEqual(self.texterra.metrics()['prefetch']['hitRate'], 1.0)
+
+  def test_similarityEngine(self):
+    engine = self.texterra.similarityEngine('enwiki')
+    engine.similarityGraph([12, 13137, 9257])
+    local = engine.allPairsSimilarity([12, 13137], [9257, 12])
+    self.assertEqual(engine.metrics()['graphs'], 1)
+    remote = self.texterra.allPairsSimilarity([12, 13137], [9257, 12], 'enwiki', format='json')
+    for l, r in zip(local, remote):
+      self.assertAlmostEqual(l.weight, r.weight, places=5)
+    engine.allPairsSimilarity([12], [5407])
+    self.assertEqual(engine.metrics()['graphs'], 2)
+    self.assertIsNotNone(engine.similarity(5407, 12))
+
 # Twitter NLP Tests
 
 class TwitterAPITest(unittest.TestCase):
@@ -1,9 +1,57 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
 import os
+import sys
+from functools import partial
 from . import ispras
 
+def stampAnnotations(text, result):
+  """Adds annotated text and its annotated part to each annotation of Texterra document"""
+  annotations = result['annotations']
+  it = annotations.items() if sys.version_info[0] == 3 else annotations.iteritems()
+  for k,v in it:
+      for an in v:
+        an['text'] = text[an['start']:an['end']]
+        an['annotated-text'] = text
+  return result
+
+def transformGraph(concepts, simGraph):
+  """Builds similarity matrix {concept: {concept: similarity}} of concepts from similarity graph response"""
+  simGraph = simGraph.get('full-similarity-graph', simGraph)
+  # XML graph wraps lists into 'entry'/'double' nodes and rows into '#text' strings,
+  # JSON graph has plain lists of entries and rows of numbers
+  entries = simGraph['concept-2-position']
+  if isinstance(entries, dict): entries = entries['entry']
+  if isinstance(entries, dict): entries = [entries]
+  concept2id = dict()
+  for concept in entries:
+    idConcept =int(concept['concept']['id'])
+    concept2id[idConcept] = int(concept['integer'])
+
+  rows = simGraph['similarity']
+  if isinstance(rows, dict): rows = rows['double']
+  if not isinstance(rows, list): rows = [rows]
+  fullMatrix = dict()
+  for pos1, item in enumerate(rows):
+    if not pos1 in fullMatrix:
+      fullMatrix[pos1] = dict()
+    if isinstance(item, dict): item = item['#text']
+    values = item.split(", ") if not isinstance(item, list) else item
+    for add, val in enumerate(values):
+      pos2 = pos1 + add + 1
+      if not pos2 in fullMatrix:
+        fullMatrix[pos2] = dict()
+      fullMatrix[pos1][pos2] = float(val)
+      fullMatrix[pos2][pos1] = fullMatrix[pos1][pos2]
+
+  result = dict()
+  for concept1 in concepts:
+    result[concept1] = dict()
+    for concept2 in concepts:
+      id1, id2 = concept2id[concept1], concept2id[concept2]
+      result[concept1][concept2] = fullMatrix[id1][id2] if id1 != id2 else 1.0
+
+  return result
+
 class API(ispras.API):
   """This class provides methods to work with Texterra REST via OpenAPI, including NLP and EKB methods and custom queriesю
     Note that NLP methods return annotations only"""
@@ -26,49 +74,56 @@ class API(ispras.API):
         'params': {
           'class': 'sentence',
           'filtering': 'KEEPING'
-        }
+        },
+        'sentenceLocal': True
     },
     'tokenization': {
         'path': 'nlp/token',
         'params': {
           'class': 'token',
           'filtering': 'KEEPING'
-        }
+        },
+        'sentenceLocal': True
     },
     'lemmatization': {
         'path': 'nlp/lemma',
         'params': {
           'class': 'lemma',
           'filtering': 'KEEPING'
-        }
+        },
+        'sentenceLocal': True
     },
     'posTagging': {
         'path': 'nlp/pos',
         'params': {
           'class': 'pos-token',
           'filtering': 'KEEPING'
-        }
+        },
+        'sentenceLocal': True
     },
     'spellingCorrection': {
         'path': 'nlp/spellingcorrection',
         'params': {
           'class': 'spelling-correction-token',
           'filtering': 'KEEPING'
-        }
+        },
+        'sentenceLocal': True
     },
     'namedEntities': {
         'path': 'nlp/namedentity',
         'params': {
           'class': 'named-entity',
           'filtering': 'KEEPING'
-        }
+        },
+        'paragraphLocal': True
     },
     'termDetection': {
         'path': 'nlp/term',
         'params': {
           'class': 'frame',
           'filtering': 'KEEPING'
-        }
+        },
+        'paragraphLocal': True
     },
     'disambiguation': {
         'path': 'nlp/disambiguation',
@@ -176,10 +231,17 @@ class API(ispras.API):
     'similarOverFilteredNeighbours': {
       'path': 'similarity/{0}/similar/all',
       'params': {}
+    },
+    'attributes': {
+      'path': 'walker/{0}',
+      'params': {}
     }
   }
 
 
+  # AttributePrefetcher requesting attributes of disambiguated concepts in background, see prefetch module
+  prefetcher = None
+
   def __init__(self, key=os.getenv('TEXTERRA_CUSTOM_KEY', False), name=None, ver=None, host=os.getenv('TEXTERRA_CUSTOM_HOST', None)):
     """Provide only apikey to use default Texterra service name and version."""
     if host == None:
@@ -223,7 +285,43 @@ class API(ispras.API):
       Note: this method returns Texterra annotations"""
     return self.disambiguationAnnotate(text)['annotations']['disambiguated-phrase']
 
+  def nlpBatcher(self, methodName, maxDelay=0.01, maxBytes=16384, maxInFlight=4):
+    """Returns batcher packing texts submitted from many threads into single request of preset NLP method,
+      e.g. nlpBatcher('tokenization').annotate(text), up to maxInFlight requests are sent at once.
+      Only sentence-local methods are supported: sentenceDetection, tokenization, lemmatization, posTagging, spellingCorrection"""
+    from . import batching
+    return batching.NLPBatcher(self, methodName, maxDelay, maxBytes, maxInFlight=maxInFlight)
+
+  def incrementalAnnotator(self, methodName, granularity='paragraph', maxDocuments=128):
+    """Returns annotator which re-annotates only changed paragraphs (or sentences) of edited documents,
+      e.g. incrementalAnnotator('namedEntities').annotate(documentId, text).
+      Supported methods have output local to the unit: 'sentenceLocal' in NLPSpecs for sentence granularity,
+      'sentenceLocal' or 'paragraphLocal' for paragraph granularity"""
+    from . import incremental
+    specs = API.NLPSpecs[methodName]
+    local = specs.get('sentenceLocal') or (granularity == 'paragraph' and specs.get('paragraphLocal'))
+    if not local:
+      raise ValueError('{0} output is not local to {1}s and can not be updated incrementally'.format(methodName, granularity))
+    return incremental.IncrementalAnnotator(partial(self.__presetNLP, methodName), granularity, maxDocuments)
+
+  def nearDuplicates(self, methodName, threshold=0.8, verify=False):
+    """Returns dedup.NearDuplicates annotating lists of texts with one request per group of near-duplicates,
+      e.g. nearDuplicates('namedEntities').annotate(tweets).
+      With verify set, duplicates whose annotations touch changed parts are annotated on their own"""
+    from . import dedup
+    return dedup.NearDuplicates(partial(self.__presetNLP, methodName), threshold, verify=verify)
+
   # NLP annotating methods
+  def iterAnnotations(self, methodName, text):
+    """Yields (class, annotation) pairs of preset NLP method (e.g. 'posTagging') as the response is being received,
+      so processing starts before the whole document arrives and memory does not grow with response size"""
+    from . import streaming
+    specs = API.NLPSpecs[methodName]
+    for annotationClass, an in streaming.iterAnnotations(self.POSTChunks(specs['path'], specs['params'], {'text': text})):
+      an['text'] = text[an['start']:an['end']]
+      an['annotated-text'] = text
+      yield annotationClass, an
+
   def languageDetectionAnnotate(self, text):
     """Detects language of given text.
       Note: this method returns Texterra document"""
@@ -301,15 +399,7 @@ class API(ispras.API):
     if domain != '':
       domain = '({})'.format(domain)
 
-    result = self.POST(specs['path'].format(domain), specs['params'], {'text': text}, 'json')
-    annotations = result['annotations']
-    import sys
-    it = annotations.items() if sys.version_info[0] == 3 else annotations.iteritems()
-    for k,v in it:
-        for an in v:
-          an['text'] = text[an['start']:an['end']]
-          an['annotated-text'] = text
-    return result
+    return self.POSTDocument(specs['path'].format(domain), specs['params'], {'text': text}, 'json', partial(stampAnnotations, text), 'domainPolarityDetection')
 
   def tweetNormalization(self, text):
     """Detects Twitter-specific entities: Hashtags, User names, Emoticons, URLs.
@@ -340,24 +430,16 @@ class API(ispras.API):
     specs = API.KBMSpecs['representationTerms']
     queryParam = specs['params']
     queryParam['featureType'] = featureType
-    url = self.url + specs['path']
-    if self.apikey: queryParam['apikey'] = self.apikey
     payload = {
       'text': text,
       'annotations': {
         'term-candidate': termCandidates
       }
     }
-    page = requests.post(url, params=queryParam, json=payload, timeout=60)
-    if page.status_code == 200:
-      return page.json()
-    else:
-      page.raise_for_status()
+    return self.POST(specs['path'], queryParam, None, 'json', json=payload)
 
-  def neighbours(self, concepts, kbname, linkType=None, nodeType=None, minDepth=None, maxDepth=None):
-    """Return neighbour concepts for the given concepts(list or single concept, each concept is {id}, {kbname} is separate parameter).
-      If at least one traverse parameter(check REST Documentation for values) is specified, all other parameters should also be specified """
-    concept = self.__wrapConcepts(concepts, kbname)
+  def __traverseParams(self, linkType, nodeType, minDepth, maxDepth):
+    """Utility wrapper for traverse matrix parameters"""
     traverse = ''
     if linkType:
       traverse += ';linkType=' + linkType
@@ -367,53 +449,82 @@ class API(ispras.API):
       traverse += ';minDepth=' + str(minDepth)
     if maxDepth:
       traverse += ';maxDepth=' + str(maxDepth)
-    return self.__presetKBM('neighbours', [concept, traverse])
+    return traverse
 
-  def neighboursSize(self, concepts, kbname, linkType=None, nodeType=None, minDepth=None, maxDepth=None):
+  def neighbours(self, concepts, kbname, linkType=None, nodeType=None, minDepth=None, maxDepth=None, format='xml'):
+    """Return neighbour concepts for the given concepts(list or single concept, each concept is {id}, {kbname} is separate parameter).
+      If at least one traverse parameter(check REST Documentation for values) is specified, all other parameters should also be specified
+      With format='json' returns list of records.Concept"""
+    from . import records
+    concept = self.__wrapConcepts(concepts, kbname)
+    traverse = self.__traverseParams(linkType, nodeType, minDepth, maxDepth)
+    result = self.__presetKBM('neighbours', [concept, traverse], format=format)
+    return records.concepts(result) if format == 'json' else result
+
+  def neighboursSize(self, concepts, kbname, linkType=None, nodeType=None, minDepth=None, maxDepth=None, format='xml'):
     """Return neighbour concepts size for the given concepts(list or single concept, each concept is {id}, {kbname} is separate parameter).
       If at least one traverse parameter(check REST Documentation for values) is specified, all other parameters should also be specified """
     concept = self.__wrapConcepts(concepts, kbname)
-    traverse = ''
-    if linkType:
-      traverse += ';linkType=' + linkType
-    if nodeType:
-      traverse += ';nodeType=' + nodeType
-    if minDepth:
-      traverse += ';minDepth=' + str(minDepth)
-    if maxDepth:
-      traverse += ';maxDepth=' + str(maxDepth)
+    traverse = self.__traverseParams(linkType, nodeType, minDepth, maxDepth)
     traverse+='/size'
-    return self.__presetKBM('neighbours', [concept, traverse])
-
-  def __transformGraph(self, concepts, simGraph):
-    concept2id = dict()
-    for concept in simGraph['concept-2-position']['entry']:
-      idConcept =int(concept['concept']['id'])
-      concept2id[idConcept] = int(concept['integer'])
-
-    fullMatrix = dict()
-    for pos1, item in enumerate(simGraph['similarity']['double']):
-      if not pos1 in fullMatrix:
-        fullMatrix[pos1] = dict()
-      for add, val in enumerate(item['#text'].split(", ")):
-        pos2 = pos1 + add + 1
-        if not pos2 in fullMatrix:
-          fullMatrix[pos2] = dict()
-        fullMatrix[pos1][pos2] = float(val)
-        fullMatrix[pos2][pos1] = fullMatrix[pos1][pos2]
-
-    result = dict()
-    for concept1 in concepts:
-      result[concept1] = dict()
-      for concept2 in concepts:
-        id1, id2 = concept2id[concept1], concept2id[concept2]
-        result[concept1][concept2] = fullMatrix[id1][id2] if id1 != id2 else 1.0
-
-    return result
-
-  def similarityGraph(self, concepts, kbname, linkWeight='MAX'):
+    return self.__presetKBM('neighbours', [concept, traverse], format=format)
+
+  def traverseNeighbours(self, concepts, kbname, linkType=None, nodeType=None, maxDepth=2, fanout=None, chunkSize=50, workers=4, maxRequests=None, maxEdges=None):
+    """Breadth-first search over neighbours of the given concepts(list or single concept, each concept is {id}, {kbname} is separate parameter).
+      Yields records.Edge(source, target, depth) as they are discovered, each concept is expanded only once.
+      Each frontier is fetched with neighbours requests of chunkSize concepts, run by workers threads.
+      fanout caps neighbours taken from each concept, maxRequests and maxEdges stop search early.
+      linkType and nodeType restrict traversed links, check REST Documentation for values"""
+    from . import traversal
+    from . import records
+    if not isinstance(concepts, list):
+      concepts = [concepts]
+    traverse = self.__traverseParams(linkType, nodeType, 1, 1) if linkType or nodeType else ''
+    roots = [records.Concept(int(c), kbname) for c in concepts]
+    return traversal.traverse(self.__inCallerLane(partial(self.__neighbourGroups, traverse=traverse)), roots, maxDepth, fanout, chunkSize, workers, maxRequests, maxEdges)
+
+  def __inCallerLane(self, function):
+    """Utility wrapper keeping scheduler lane of the caller in worker threads"""
+    return self.scheduler.bind(function) if self.scheduler is not None else function
+
+  # Cleared when service does not group neighbours of several concepts by source concept
+  __groupedNeighbours = True
+
+  def __neighbourGroups(self, concepts, traverse=''):
+    """Returns list of (source Concept, list of neighbour Concepts) for list of Concept records of one knowledge base"""
+    from . import records
+    kbname = concepts[0].kb
+    if len(concepts) > 1 and self.__groupedNeighbours:
+      result = self.__presetKBM('neighbours', [self.__wrapConcepts([c.id for c in concepts], kbname), traverse], {}, 'json')
+      groups = records.neighbourGroups(result, concepts)
+      if groups is not None:
+        return groups
+      self.__groupedNeighbours = False
+    groups = []
+    for concept in concepts:
+      result = self.__presetKBM('neighbours', [self.__wrapConcepts(concept.id, kbname), traverse], {}, 'json')
+      groups.extend(records.neighbourGroups(result, [concept]))
+    return groups
+
+  def graphStore(self, kbname, path=None, chunkSize=50):
+    """Returns graphstore.GraphStore for concepts of knowledge base kbname, memory-mapped from path if it is provided.
+      Neighbours of concepts missing in the store are requested from the service with neighbours requests of chunkSize concepts.
+      Fill it with addEdges(traverseNeighbours(...)) and addAttributes(getAttributes(..., format='json'))"""
+    from . import graphstore
+    if path is not None:
+      return graphstore.GraphStore.load(path, self.__neighbourGroups, chunkSize)
+    return graphstore.GraphStore(kbname, self.__neighbourGroups, chunkSize)
+
+  def similarityEngine(self, kbname, linkWeight='MAX', maxFetchConcepts=50):
+    """Returns similarity.SimilarityEngine, which keeps matrices of its similarityGraph calls
+      and computes allPairsSimilarity from them without requests when all pairs are known"""
+    from . import similarity
+    return similarity.SimilarityEngine(self, kbname, linkWeight, maxFetchConcepts)
+
+  def similarityGraph(self, concepts, kbname, linkWeight='MAX', format='xml'):
     """Compute similarity for each pair of concepts(list or single concept, each concept is {id}, kbname is separated).
-      linkWeight specifies method for computation of link weight in case of multiple link types - check REST Documentation for values"""
+      linkWeight specifies method for computation of link weight in case of multiple link types - check REST Documentation for values
+      format='json' requests graph in JSON, which is cheaper to parse; result is the same"""
     if isinstance(concepts, int):
       return {concepts: 1.0}
     if len(concepts) == 0:
@@ -422,54 +533,68 @@ class API(ispras.API):
       return {concepts[0]: 1.0}
     param = self.__wrapConcepts(concepts, kbname)
     param += 'linkWeight=' + linkWeight
-    return self.__transformGraph(concepts, self.__presetKBM('similarityGraph', param)['full-similarity-graph'])
+    return self.__presetKBM('similarityGraph', param, format=format, transform=partial(transformGraph, concepts))
 
-  def allPairsSimilarity(self, firstConcepts, secondConcepts, kbname, linkWeight='MAX'):
+  def allPairsSimilarity(self, firstConcepts, secondConcepts, kbname, linkWeight='MAX', format='xml'):
     """Computes sum of similarities from each concepts(list or single concept, each concept is {id}, {kbname} is separate parameter) from the first list to all concepts(list or single concept, each concept is {id}, {kbname} is separate parameter) from the second one.
-      linkWeight specifies method for computation of link weight in case of multiple link types - check REST Documentation for values"""
+      linkWeight specifies method for computation of link weight in case of multiple link types - check REST Documentation for values
+      With format='json' returns list of records.WeightedConcept"""
+    from . import records
     first = self.__wrapConcepts(firstConcepts, kbname)
     first += 'linkWeight={};'.format(linkWeight)
     second = self.__wrapConcepts(secondConcepts, kbname)
-    return self.__presetKBM('allPairsSimilarity', [first, second])
+    result = self.__presetKBM('allPairsSimilarity', [first, second], format=format)
+    return records.weightedConcepts(result) if format == 'json' else result
 
-  def similarityToVirtualArticle(self, concepts, virtualAricle, kbname, linkWeight='MAX'):
+  def similarityToVirtualArticle(self, concepts, virtualAricle, kbname, linkWeight='MAX', format='xml'):
     """Compute similarity from each concept from the first list to all concepts(list or single concept, each concept is {id}, {kbname} is separate parameter) from the second list as a whole.
       Links of second list concepts(each concept is {id}, {kbname} is separate parameter) are collected together, thus forming a "virtual" article, similarity to which is computed.
-      linkWeight specifies method for computation of link weight in case of multiple link types - check REST Documentation for values"""
+      linkWeight specifies method for computation of link weight in case of multiple link types - check REST Documentation for values
+      With format='json' returns list of records.WeightedConcept"""
+    from . import records
     first = self.__wrapConcepts(concepts, kbname)
     first += 'linkWeight={};'.format(linkWeight)
     second = self.__wrapConcepts(virtualAricle, kbname)
-    return self.__presetKBM('similarityToVirtualArticle', [first, second])
+    result = self.__presetKBM('similarityToVirtualArticle', [first, second], format=format)
+    return records.weightedConcepts(result) if format == 'json' else result
 
-  def similarityBetweenVirtualArticles(self, firstVirtualAricle, secondVirtualArticle, kbname, linkWeight='MAX'):
+  def similarityBetweenVirtualArticles(self, firstVirtualAricle, secondVirtualArticle, kbname, linkWeight='MAX', format='xml'):
     """Compute similarity between two sets of concepts(list or single concept, each concept is {id}, {kbname} is separate parameter) as between "virtual" articles from these sets.
       The links of each virtual article are composed of links of the collection of concepts.
-      linkWeight specifies method for computation of link weight in case of multiple link types - check REST Documentation for values"""
+      linkWeight specifies method for computation of link weight in case of multiple link types - check REST Documentation for values
+      With format='json' returns list of records.WeightedConcept"""
+    from . import records
     first = self.__wrapConcepts(firstVirtualAricle, kbname)
     first += 'linkWeight={};'.format(linkWeight)
     second = self.__wrapConcepts(secondVirtualArticle, kbname)
-    return self.__presetKBM('similarityBetweenVirtualArticles', [first, second])
+    result = self.__presetKBM('similarityBetweenVirtualArticles', [first, second], format=format)
+    return records.weightedConcepts(result) if format == 'json' else result
 
-  def similarOverFirstNeighbours(self, concepts, kbname, linkWeight='MAX', offset=None, limit=None):
+  def similarOverFirstNeighbours(self, concepts, kbname, linkWeight='MAX', offset=None, limit=None, format='xml'):
     """Search for similar concepts among the first neighbours of the given ones(list or single concept, each concept is {id}, {kbname} is separate parameter).
       linkWeight specifies method for computation of link weight in case of multiple link types.
       offset provides a possibility to skip several concepts from the start of the result.
       limit provides a possibility to limit size of result.
+      With format='json' returns list of records.WeightedConcept
       check REST Documentation for values"""
+    from . import records
     path = '{0};linkWeight={1}'.format(self.__wrapConcepts(concepts, kbname), linkWeight)
     query = {}
     if offset:
       query.update({'offset': offset})
     if limit:
       query.update({'limit': limit})
-    return self.__presetKBM('similarOverFirstNeighbours', path, query)
+    result = self.__presetKBM('similarOverFirstNeighbours', path, query, format)
+    return records.weightedConcepts(result) if format == 'json' else result
 
-  def similarOverFilteredNeighbours(self, concepts, kbname, linkWeight='MAX', offset=None, limit=None, among=None):
+  def similarOverFilteredNeighbours(self, concepts, kbname, linkWeight='MAX', offset=None, limit=None, among=None, format='xml'):
     """Search for similar concepts over filtered set of the first and the second neighbours of the given ones(list or single concept, each concept is {id}, {kbname} is separate parameter).
       linkWeight specifies method for computation of link weight in case of multiple link types.
       offset provides a possibility to skip several concepts from the start of the result.
       limit provides a possibility to limit size of result.
+      With format='json' returns list of records.WeightedConcept
       check REST Documentation for values"""
+    from . import records
     path = '{0};linkWeight={1}'.format(self.__wrapConcepts(concepts, kbname), linkWeight)
     query = {'among': ''}
     if offset:
@@ -478,9 +603,26 @@ class API(ispras.API):
       query.update({'limit': limit})
     if among:
       query.update({'among': among})
-    return self.__presetKBM('similarOverFilteredNeighbours', path, query)
-
-  def getAttributes(self, concepts, kbname, atrList=[]):
+    result = self.__presetKBM('similarOverFilteredNeighbours', path, query, format)
+    return records.weightedConcepts(result) if format == 'json' else result
+
+  def iterSimilarOverFirstNeighbours(self, concepts, kbname, linkWeight='MAX', pageSize=50, prefetch=2):
+    """Iterates over records.WeightedConcept of similarOverFirstNeighbours result page by page.
+      Next pages are requested in background, page size adapts to measured latency"""
+    from . import paging
+    def fetch(offset, limit):
+      return self.similarOverFirstNeighbours(concepts, kbname, linkWeight, offset, limit, format='json')
+    return paging.iterPages(self.__inCallerLane(fetch), pageSize, prefetch)
+
+  def iterSimilarOverFilteredNeighbours(self, concepts, kbname, linkWeight='MAX', among=None, pageSize=50, prefetch=2):
+    """Iterates over records.WeightedConcept of similarOverFilteredNeighbours result page by page.
+      Next pages are requested in background, page size adapts to measured latency"""
+    from . import paging
+    def fetch(offset, limit):
+      return self.similarOverFilteredNeighbours(concepts, kbname, linkWeight, offset, limit, among, format='json')
+    return paging.iterPages(self.__inCallerLane(fetch), pageSize, prefetch)
+
+  def getAttributes(self, concepts, kbname, atrList=[], format='xml'):
     """Get attributes for concepts(list or single concept, each concept is {id}, {kbname} is separate parameter).
       Supported attributes:
         coordinates - GPS coordinates
@@ -491,39 +633,47 @@ class API(ispras.API):
         title - concept title
         translation(<language>) textual representation of the concept on the specified language
         <language> - language code, like: en, de, fr, ko, ru, ...
-        type - concept type"""
+        type - concept type
+      With format='json' returns list of records.ConceptAttributes"""
+    from . import records
+    if format == 'json' and self.prefetcher is not None:
+      prefetched = self.prefetcher.lookup([int(c) for c in (concepts if isinstance(concepts, list) else [concepts])], kbname, atrList)
+      if prefetched is not None:
+        return prefetched
     params = {'attribute': atrList}
-    return self.customQuery('walker/{}'.format(self.__wrapConcepts(concepts, kbname)), params)
+    result = self.__presetKBM('attributes', self.__wrapConcepts(concepts, kbname), params, format)
+    return records.conceptAttributes(result) if format == 'json' else result
+
 
+  def metrics(self):
+    """Returns metrics of client components"""
+    result = ispras.API.metrics(self)
+    if self.prefetcher is not None:
+      result['prefetch'] = self.prefetcher.metrics()
+    return result
 
-  def customQuery(self, path, query, form=None):
+  def customQuery(self, path, query, form=None, format='xml'):
     """Invoke custom request to Texterra."""
     if form:
-      return self.POST(path, query, form)
+      return self.POST(path, query, form, format)
     else:
-      return self.GET(path, query)
+      return self.GET(path, query, format)
 
   def __presetNLP(self, methodName, text):
     """Utility NLP part method"""
-    import sys
-
     specs = API.NLPSpecs[methodName]
-    result = self.POST(specs['path'], specs['params'], {'text': text}, 'json')
-    annotations = result['annotations']
-    it = annotations.items() if sys.version_info[0] == 3 else annotations.iteritems()
-    for k,v in it:
-        for an in v:
-          an['text'] = text[an['start']:an['end']]
-          an['annotated-text'] = text
+    result = self.POSTDocument(specs['path'], specs['params'], {'text': text}, 'json', partial(stampAnnotations, text), methodName)
+    if self.prefetcher is not None:
+      self.prefetcher.observe(result)
     return result
 
-  def __presetKBM(self, methodName, pathParam, queryParam={}):
+  def __presetKBM(self, methodName, pathParam, queryParam={}, format='xml', transform=None):
     """Utility EKB part method"""
     specs = API.KBMSpecs[methodName]
     queryParam.update(specs['params'])
     if isinstance(pathParam, list):
-      result = self.customQuery(specs['path'].format(*pathParam), queryParam)
+      result = self.GET(specs['path'].format(*pathParam), queryParam, format, transform)
     else:
-      result = self.customQuery(specs['path'].format(pathParam), queryParam)
+      result = self.GET(specs['path'].format(pathParam), queryParam, format, transform)
 
     return result
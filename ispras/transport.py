@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Transport backends sending API calls"""
+import threading
+import time
+from collections import namedtuple
+
+Request = namedtuple('Request', ['method', 'url', 'params', 'headers', 'data', 'json'])
+
+class Response(object):
+  """Response of transports other than requests, with the part of requests.Response interface the client uses"""
+
+  def __init__(self, status_code, content=b'', headers={}, url=None, chunks=None, close=None):
+    self.status_code = status_code
+    self.headers = headers
+    self.url = url
+    self._content = content
+    self._chunks = chunks
+    self._close = close
+
+  @property
+  def content(self):
+    if self._chunks is not None:
+      self._content, self._chunks = b''.join(self._chunks), None
+      self.close()
+    return self._content
+
+  def iter_content(self, chunkSize=1):
+    if self._chunks is not None:
+      chunks, self._chunks = self._chunks, None
+      return chunks
+    return (self._content[i:i + chunkSize] for i in range(0, len(self._content), chunkSize))
+
+  def raise_for_status(self):
+    if self.status_code >= 400:
+      import requests
+      raise requests.exceptions.HTTPError('{0} Error for url: {1}'.format(self.status_code, self.url), response=self)
+
+  def close(self):
+    if self._close is not None:
+      self._close()
+      self._close = None
+
+class RequestsTransport(object):
+  """requests with one pooled session, so that connections are kept alive between calls"""
+
+  def __init__(self, poolSize=10):
+    self.poolSize = poolSize
+    self._session = None
+    self._lock = threading.Lock()
+
+  def request(self, method, url, **kwargs):
+    if self._session is None:
+      with self._lock:
+        if self._session is None:
+          import requests
+          session = requests.Session()
+          adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.poolSize)
+          session.mount('http://', adapter)
+          session.mount('https://', adapter)
+          self._session = session
+    return self._session.request(method, url, **kwargs)
+
+class HTTP2Transport(object):
+  """Runs concurrent calls as streams multiplexed over HTTP/2 connections (at most maxConnections per host),
+    so thousands of calls in flight do not need thousands of sockets.
+    Needs httpx with http2 extra (pip install httpx[http2]), Python 3 only.
+    Errors are raised as requests exceptions, so retries, deadlines and breaker work unchanged"""
+
+  def __init__(self, maxConnections=1):
+    self.maxConnections = maxConnections
+    self._client = None
+    self._lock = threading.Lock()
+
+  def _connect(self):
+    with self._lock:
+      if self._client is None:
+        import httpx
+        self._client = httpx.Client(http2=True, limits=httpx.Limits(max_connections=self.maxConnections, max_keepalive_connections=self.maxConnections))
+      return self._client
+
+  def request(self, method, url, params=None, headers=None, timeout=None, data=None, json=None, stream=False):
+    import httpx
+    import requests
+    client = self._client or self._connect()
+    kwargs = {'params': params, 'headers': headers}
+    if isinstance(data, bytes):
+      kwargs['content'] = data
+    elif data is not None:
+      kwargs['data'] = data
+    if json is not None:
+      kwargs['json'] = json
+    if isinstance(timeout, tuple):
+      kwargs['timeout'] = httpx.Timeout(timeout[1], connect=timeout[0])
+    elif timeout is not None:
+      kwargs['timeout'] = timeout
+    try:
+      response = client.send(client.build_request(method.upper(), url, **kwargs), stream=stream)
+      if not stream:
+        return Response(response.status_code, response.content, response.headers, url)
+    except httpx.TimeoutException as e:
+      raise requests.exceptions.Timeout(str(e))
+    except httpx.TransportError as e:
+      raise requests.exceptions.ConnectionError(str(e))
+    return Response(response.status_code, headers=response.headers, url=url, chunks=self._chunks(response), close=response.close)
+
+  @staticmethod
+  def _chunks(response):
+    import httpx
+    import requests
+    try:
+      for chunk in response.iter_bytes():
+        yield chunk
+    except httpx.TimeoutException as e:
+      raise requests.exceptions.Timeout(str(e))
+    except httpx.TransportError as e:
+      raise requests.exceptions.ConnectionError(str(e))
+    finally:
+      response.close()
+
+  def close(self):
+    with self._lock:
+      if self._client is not None:
+        self._client.close()
+        self._client = None
+
+class LocalTransport(object):
+  """In-process stand-in for the service in tests and benchmarks: handler(Request) returns Response
+    or (status code, content) pair, content strings are encoded to UTF-8. Exceptions raised by handler,
+    e.g. requests.exceptions.ConnectionError, reach the client as network errors do. latency (seconds) is added to each call.
+      t.transport = LocalTransport(lambda request: (200, '{"annotations": {}}'))"""
+
+  def __init__(self, handler, latency=0):
+    self.handler = handler
+    self.latency = latency
+    self.calls = 0
+
+  def request(self, method, url, params=None, headers=None, timeout=None, data=None, json=None, stream=False):
+    self.calls += 1
+    if self.latency:
+      time.sleep(self.latency)
+    result = self.handler(Request(method, url, params, headers, data, json))
+    if isinstance(result, Response):
+      return result
+    status, content = result
+    if not isinstance(content, bytes):
+      content = content.encode('utf-8')
+    return Response(status, content, url=url)
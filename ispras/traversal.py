@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Breadth-first traversal of knowledge base over batched neighbours requests"""
+from .records import Edge
+
+class VisitedSet(object):
+  """Set of visited concept ids. Ids are sparse (tens of millions apart), so a hash set is smaller than a bitmap over them"""
+
+  def __init__(self):
+    self.ids = set()
+
+  def add(self, ident):
+    """Adds id, returns False if it was already there"""
+    if ident in self.ids:
+      return False
+    self.ids.add(ident)
+    return True
+
+  def __contains__(self, ident):
+    return ident in self.ids
+
+  def __len__(self):
+    return len(self.ids)
+
+def traverse(fetch, roots, maxDepth=2, fanout=None, chunkSize=50, workers=4, maxRequests=None, maxEdges=None):
+  """Yields Edge records discovered by breadth-first search from roots (list of Concept).
+    fetch(chunk) returns list of (source Concept, list of neighbour Concepts) for list of concepts.
+    Each frontier is split into chunks of chunkSize concepts fetched by workers threads.
+    fanout caps neighbours taken from each node, maxRequests and maxEdges stop search early.
+    Closing the generator stops search as well."""
+  visited = VisitedSet()
+  frontier = [root for root in roots if visited.add(root.id)]
+  requests, edges, depth = 0, 0, 0
+  from multiprocessing.pool import ThreadPool
+  pool = ThreadPool(workers)
+  try:
+    while frontier and depth < maxDepth:
+      chunks = [frontier[i:i + chunkSize] for i in range(0, len(frontier), chunkSize)]
+      if maxRequests is not None:
+        chunks = chunks[:maxRequests - requests]
+      requests += len(chunks)
+      depth += 1
+      frontier = []
+      for groups in pool.imap_unordered(fetch, chunks):
+        for source, targets in groups:
+          if fanout is not None:
+            targets = targets[:fanout]
+          for target in targets:
+            yield Edge(source, target, depth)
+            edges += 1
+            if maxEdges is not None and edges >= maxEdges:
+              return
+            if visited.add(target.id):
+              frontier.append(target)
+      if maxRequests is not None and requests >= maxRequests:
+        return
+  finally:
+    pool.terminate()
@@ -32,7 +32,26 @@ class API(ispras.API):
         'description': description,
         'tweet': tweets
     }
-    return self.POST('extract', {}, form)
+    return self.POSTDocument('extract', {}, form, name='extractDDE')
+
+  def extractDDEMany(self, profiles, threshold=0.8):
+    """Extracts demographic attributes for list of dicts of extractDDE arguments.
+      Profiles with equal lang, username and screenname and near-duplicate description and tweets are sent once"""
+    import copy
+    from . import dedup
+    texts, keys = [], []
+    for profile in profiles:
+      tweets = profile['tweets']
+      if isinstance(tweets, list):
+        tweets = ' '.join(tweets)
+      texts.append(u'{0}\n{1}'.format(profile['description'], tweets))
+      keys.append((profile['lang'], profile['username'], profile['screenname']))
+    representatives = dedup.collapse(texts, keys, threshold)
+    results = {}
+    for i, r in enumerate(representatives):
+      if r not in results:
+        results[r] = self.extractDDE(**profiles[r])
+    return [results[r] if r == i else copy.deepcopy(results[r]) for i, r in enumerate(representatives)]
 
   def customQuery(self, path, query, form=None):
     """Invoke custom request to Twitter NLP"""
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Encoding of text request bodies"""
+import sys
+import threading
+
+MODES = ('form', 'json', 'raw', 'multipart')
+# Bytes kept as is by form encoding, space becomes '+'
+PLAIN = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_.-~ '
+
+def utf8(value):
+  if isinstance(value, bytes):
+    return value
+  if sys.version_info[0] == 2 and not isinstance(value, unicode):
+    value = unicode(value)
+  elif sys.version_info[0] == 3 and not isinstance(value, str):
+    value = str(value)
+  return value.encode('utf-8')
+
+def formSize(fields):
+  """Length of application/x-www-form-urlencoded body of fields, without building it"""
+  size = 0
+  for k, v in fields:
+    for part in (k, v):
+      size += len(part) + 2 * len(part.translate(None, PLAIN))
+  return size + 2 * len(fields) - 1 if fields else 0
+
+def encode(mode, form):
+  """Returns (requests keyword arguments, body size, form-encoded body size) of form dict sent in mode:
+    'form' is url-encoded form, 'json' is UTF-8 JSON object, 'raw' is UTF-8 text of the only field
+    (forms of several fields are sent as multipart), 'multipart' is multipart/form-data of UTF-8 fields"""
+  fields = [(utf8(k), utf8(v)) for k, v in sorted(form.items()) if v is not None]
+  size = formSize(fields)
+  if mode == 'form':
+    return {'data': form}, size, size
+  if mode == 'json':
+    import json
+    body = json.dumps(dict((k.decode('utf-8'), v.decode('utf-8')) for k, v in fields), ensure_ascii=False).encode('utf-8')
+    return {'data': body, 'headers': {'Content-Type': 'application/json; charset=utf-8'}}, len(body), size
+  if mode == 'raw' and len(fields) == 1:
+    body = fields[0][1]
+    return {'data': body, 'headers': {'Content-Type': 'text/plain; charset=utf-8'}}, len(body), size
+  if mode in ('raw', 'multipart'):
+    import hashlib
+    # Boundary depends on content only, so that equal requests have equal bodies for cache
+    digest = hashlib.sha1()
+    for k, v in fields:
+      digest.update(v)
+    boundary = digest.hexdigest().encode('ascii')
+    parts = []
+    for k, v in fields:
+      parts.append(b'--' + boundary + b'\r\nContent-Disposition: form-data; name="' + k + b'"\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n' + v + b'\r\n')
+    parts.append(b'--' + boundary + b'--\r\n')
+    body = b''.join(parts)
+    return {'data': body, 'headers': {'Content-Type': 'multipart/form-data; boundary=' + boundary.decode('ascii')}}, len(body), size
+  raise ValueError('Unknown upload mode {0}, expected one of {1}'.format(mode, ', '.join(MODES)))
+
+class UploadMeter(object):
+  """Counts sent body bytes and bytes the same bodies take form-encoded, by method"""
+
+  def __init__(self):
+    self._methods = {}
+    self._lock = threading.Lock()
+
+  def record(self, name, sent, form):
+    with self._lock:
+      counts = self._methods.setdefault(name, {'requests': 0, 'bytes': 0, 'formBytes': 0})
+      counts['requests'] += 1
+      counts['bytes'] += sent
+      counts['formBytes'] += form
+
+  def metrics(self):
+    with self._lock:
+      result = {}
+      for name, counts in self._methods.items():
+        result[name] = dict(counts)
+        result[name]['saved'] = counts['formBytes'] - counts['bytes']
+      return result